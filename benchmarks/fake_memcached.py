@@ -0,0 +1,148 @@
+"""
+Fake memcached speaking the text protocol subset used by
+cache_utils (get/gets, set/add/replace/cas, delete, incr/decr, touch,
+flush_all), for benchmarks on machines without memcached.
+
+    server, address = start()
+    ...
+    server.shutdown()
+
+or in a separate process (`start_process`), or on its own:
+
+    $ python benchmarks/fake_memcached.py 11211
+"""
+import multiprocessing
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+
+class Store(object):
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.cas = 0
+
+    def _get(self, key):
+        item = self.items.get(key)
+        if item is not None and item[2] and item[2] < time.time():
+            del self.items[key]
+            return None
+        return item
+
+    @staticmethod
+    def _expiry(timeout):
+        timeout = int(timeout)
+        if timeout < 0:
+            return time.time() - 1
+        if timeout > 30 * 24 * 3600:
+            return timeout
+        return time.time() + timeout if timeout else 0
+
+    def execute(self, command, args, read):
+        with self.lock:
+            if command in (b'get', b'gets'):
+                out = []
+                for key in args:
+                    item = self._get(key)
+                    if item is not None:
+                        cas = b' %d' % item[3] if command == b'gets' else b''
+                        out.append(b'VALUE %s %d %d%s\r\n%s\r\n' % (key, item[1], len(item[0]), cas, item[0]))
+                return b''.join(out) + b'END\r\n'
+            if command in (b'set', b'add', b'replace', b'cas'):
+                key, flags, timeout, size = args[0], int(args[1]), args[2], int(args[3])
+                data = read(size + 2)[:-2]
+                item = self._get(key)
+                if command == b'add' and item is not None or command == b'replace' and item is None:
+                    return b'NOT_STORED\r\n'
+                if command == b'cas':
+                    if item is None:
+                        return b'NOT_FOUND\r\n'
+                    if item[3] != int(args[4]):
+                        return b'EXISTS\r\n'
+                self.cas += 1
+                self.items[key] = (data, flags, self._expiry(timeout), self.cas)
+                return b'STORED\r\n'
+            if command == b'delete':
+                return b'DELETED\r\n' if self.items.pop(args[0], None) else b'NOT_FOUND\r\n'
+            if command in (b'incr', b'decr'):
+                item = self._get(args[0])
+                if item is None:
+                    return b'NOT_FOUND\r\n'
+                delta = int(args[1]) if command == b'incr' else -int(args[1])
+                value = b'%d' % max(int(item[0]) + delta, 0)
+                self.items[args[0]] = (value,) + item[1:]
+                return value + b'\r\n'
+            if command == b'touch':
+                item = self._get(args[0])
+                if item is None:
+                    return b'NOT_FOUND\r\n'
+                self.items[args[0]] = item[:2] + (self._expiry(args[1]), item[3])
+                return b'TOUCHED\r\n'
+            if command == b'flush_all':
+                self.items.clear()
+                return b'OK\r\n'
+            if command == b'version':
+                return b'VERSION fake\r\n'
+            return b'ERROR\r\n'
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def setup(self):
+        # as memcached does
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        socketserver.StreamRequestHandler.setup(self)
+
+    def handle(self):
+        for line in self.rfile:
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == b'quit':
+                return
+            noreply = parts[-1] == b'noreply'
+            out = self.server.store.execute(parts[0], parts[1:-1] if noreply else parts[1:], self.rfile.read)
+            if not noreply:
+                self.wfile.write(out)
+
+
+class Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address):
+        socketserver.ThreadingTCPServer.__init__(self, address, Handler)
+        self.store = Store()
+
+
+def start(host='127.0.0.1', port=0):
+    """ Serves in a daemon thread, returns the server and its address """
+    server = Server((host, port))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, '%s:%d' % server.server_address
+
+
+def _serve(host, port, ready):
+    server = Server((host, port))
+    ready.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_process(host='127.0.0.1', port=0):
+    """ Serves in a daemon process, so the server doesn't compete with
+        benchmarked threads for the GIL. Returns the process and the
+        server address.
+    """
+    ready = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(host, port, ready))
+    process.daemon = True
+    process.start()
+    return process, '%s:%d' % (host, ready.get())
+
+
+if __name__ == '__main__':
+    _serve('127.0.0.1', int(sys.argv[1]) if len(sys.argv) > 1 else 11211, multiprocessing.Queue())
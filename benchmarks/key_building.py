@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of cache key building: the per-call path `cached` used
+before keys were built by precompiled builders vs `make_key_builder`.
+
+    $ python benchmarks/key_building.py
+"""
+import os
+import sys
+import timeit
+from hashlib import sha256
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.utils.encoding import smart_str  # noqa: E402
+
+from cache_utils.utils import CONTROL_CHARACTERS, _cache_key, make_key_builder  # noqa: E402
+
+
+def legacy_sanitize(key, max_length=250):
+    key = ''.join([c for c in key if c not in CONTROL_CHARACTERS])
+    if len(key) > max_length:
+        hash = sha256(key.encode()).hexdigest()
+        key = key[:max_length - len(hash) - 1] + '-' + hash
+    return key
+
+
+def legacy_get_key(*args, **kwargs):
+    return legacy_sanitize(_cache_key(*args, **kwargs))
+
+
+def legacy_get_hashed_key(*args, **kwargs):
+    return sha256(smart_str(_cache_key(*args, **kwargs)).encode()).hexdigest()
+
+
+class Product(object):
+    def __init__(self, pk, name):
+        self.pk = pk
+        self.name = name
+
+
+CASES = [
+    ('no args', (), {}, None),
+    ('scalars', (42, 'books'), {'page': 2}, None),
+    ('long string', ('x' * 300,), {}, None),
+    ('object_attrs', (Product(1, 'pen'), [1, 2, 3]), {'full': True}, {Product: ['pk']}),
+]
+
+
+def run(number=20000):
+    name = 'app.module.func:10'
+    print("%-14s %-8s %12s %12s %8s" % ('case', 'mode', 'legacy us', 'builder us', 'speedup'))
+    for case, args, kwargs, object_attrs in CASES:
+        for mode, hashed, legacy in (('plain', False, legacy_get_key), ('hashed', True, legacy_get_hashed_key)):
+            build = make_key_builder('function', hashed=hashed, object_attrs=object_attrs)
+            assert build(name, args, kwargs) == legacy(name, 'function', args, kwargs, object_attrs)
+            old = min(timeit.repeat(lambda: legacy(name, 'function', args, kwargs, object_attrs),
+                                    number=number, repeat=3))
+            new = min(timeit.repeat(lambda: build(name, args, kwargs), number=number, repeat=3))
+            print("%-14s %-8s %12.2f %12.2f %7.2fx" % (
+                case, mode, old / number * 1e6, new / number * 1e6, old / new))
+
+
+if __name__ == '__main__':
+    run()
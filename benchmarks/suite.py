@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of the `cached` hot path and the group backend. Runs
+against a fake memcached in a child process unless a server is given, and writes
+results as JSON so runs on the same machine can be compared:
+
+    $ python benchmarks/suite.py --output before.json
+    $ python benchmarks/suite.py --output after.json --compare before.json
+
+Benchmarks:
+
+keys        building keys for varied arguments, plain, hashed and compact
+latency     `cached` hits and misses on locmem, django's pymemcache backend
+            and the group backend, with and without a group
+backend     get and set on the group backend vs django's pymemcache backend
+threads     `cached` hits per second with 1, 4 and 16 threads
+model_list  `cached` hits depending on 0, 1, 4 and 16 models
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+import fake_memcached  # noqa: E402
+import key_building  # noqa: E402
+
+
+BENCHMARKS = ['keys', 'latency', 'backend', 'threads', 'model_list']
+
+
+def measure(func, number, repeat=3):
+    """ Returns the best mean time of a `func()` call in microseconds """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / number * 1e6
+
+
+def bench_keys(number):
+    from cache_utils.utils import make_key_builder
+
+    name = 'app.module.func:10'
+    for case, args, kwargs, object_attrs in key_building.CASES:
+        for mode, options in (('plain', {}), ('hashed', {'hashed': True}), ('compact', {'key_format': 'compact'})):
+            build = make_key_builder('function', object_attrs=object_attrs, **options)
+            yield '%s %s' % (case, mode), 'us', measure(lambda: build(name, args, kwargs), number * 10)
+
+
+def _cached_function(**options):
+    from cache_utils.decorators import cached
+
+    @cached(60, **options)
+    def func(x):
+        return x
+    return func
+
+
+def bench_latency(number):
+    counter = itertools.count()
+    for name, options in (('locmem', {'backend': 'locmem'}),
+                          ('pymemcache', {'backend': 'pymemcache'}),
+                          ('group', {}),
+                          ('group with group', {'group': 'bench'})):
+        func = _cached_function(**options)
+        func(0)
+        yield '%s hit' % name, 'us', measure(lambda: func(0), number)
+        yield '%s miss' % name, 'us', measure(lambda: func(next(counter)), number)
+
+
+def bench_backend(number):
+    from django.core.cache import caches
+
+    value = {'id': 1, 'name': 'x' * 100}
+    for name, cache, options in (('pymemcache', caches['pymemcache'], {}),
+                                 ('group', caches['default'], {}),
+                                 ('group with group', caches['default'], {'group': 'bench'})):
+        cache.set('bench', value, 60, **options)
+        yield '%s get' % name, 'us', measure(lambda: cache.get('bench', **options), number)
+        yield '%s set' % name, 'us', measure(lambda: cache.set('bench', value, 60, **options), number)
+
+
+def bench_threads(number):
+    func = _cached_function()
+    func(0)
+    for threads in (1, 4, 16):
+        calls = max(number // threads, 1)
+
+        def worker():
+            for _ in range(calls):
+                func(0)
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        yield '%d threads' % threads, 'calls/s', calls * threads / (time.perf_counter() - started)
+
+
+def _models(count):
+    from django.db import models
+
+    meta = type('Meta', (), {'app_label': 'cache_utils'})
+    return [type('BenchModel%d' % i, (models.Model,), {'__module__': __name__, 'Meta': meta})
+            for i in range(count)]
+
+
+def bench_model_list(number):
+    bench_models = _models(16)
+    for count in (0, 1, 4, 16):
+        func = _cached_function(model_list=bench_models[:count])
+        func(0)
+        yield '%d models hit' % count, 'us', measure(lambda: func(0), number)
+
+
+def configure(server):
+    def memcached(backend, **options):
+        return {'BACKEND': backend, 'LOCATION': server, 'OPTIONS': options}
+    settings.configure(
+        CACHES={
+            'default': memcached('cache_utils.group_backend.CacheClass'),
+            'pymemcache': memcached('django.core.cache.backends.memcached.PyMemcacheCache'),
+            'locmem': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        },
+        INSTALLED_APPS=['cache_utils'],
+    )
+    django.setup()
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(benchmarks, number, server):
+    import pymemcache
+
+    results = []
+    for benchmark in benchmarks:
+        for name, unit, value in globals()['bench_' + benchmark](number):
+            results.append({'benchmark': benchmark, 'name': name, 'unit': unit, 'value': round(value, 3)})
+            print("%-12s %-28s %12.2f %s" % (benchmark, name, value, unit))
+    return {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'revision': _revision(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'pymemcache': pymemcache.__version__,
+            'platform': platform.platform(),
+            'server': server or 'fake',
+            'number': number,
+        },
+        'results': results,
+    }
+
+
+def compare(report, baseline):
+    """ Prints changes against a previous report, per result in both """
+    old = dict(((r['benchmark'], r['name']), r) for r in baseline['results'])
+    print("\n%-12s %-28s %12s %12s %8s" % ('benchmark', 'name', 'before', 'after', 'change'))
+    for result in report['results']:
+        before = old.get((result['benchmark'], result['name']))
+        if before is None or before['unit'] != result['unit'] or not before['value']:
+            continue
+        change = (result['value'] - before['value']) / before['value'] * 100
+        print("%-12s %-28s %12.2f %12.2f %+7.1f%%" % (
+            result['benchmark'], result['name'], before['value'], result['value'], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help="any of %s, all by default" % ", ".join(BENCHMARKS))
+    parser.add_argument('--server', help="memcached address, a fake server by default")
+    parser.add_argument('--number', type=int, default=2000, help="calls per measurement")
+    parser.add_argument('--output', help="write results to this JSON file")
+    parser.add_argument('--compare', help="print changes against this JSON file")
+    options = parser.parse_args()
+    for benchmark in options.benchmarks:
+        if benchmark not in BENCHMARKS:
+            parser.error("unknown benchmark %r" % benchmark)
+
+    server = options.server
+    if server is None:
+        fake, server = fake_memcached.start_process()
+    configure(server)
+    report = run(options.benchmarks or BENCHMARKS, options.number, options.server)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+"""
+Throughput of `group_backend.CacheClass` under threads, with a client per
+thread disconnected after every request (Django's default) vs a shared
+connection pool (the POOL option). Every simulated request reads a few
+grouped keys with one `get_many`, writes the missing ones and ends like a
+Django request does, by closing the cache.
+
+    $ python benchmarks/threaded_client.py                    # fake server
+    $ python benchmarks/threaded_client.py --server 127.0.0.1:11211
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+import fake_memcached  # noqa: E402
+
+
+CONFIGS = [
+    ('per thread', {}),
+    ('pooled', {'POOL': True}),
+]
+
+
+def request(cache, keys):
+    values = cache.get_many(keys, group='bench')
+    missing = dict((key, key * 10) for key in keys if key not in values)
+    if missing:
+        cache.set_many(missing, 60, group='bench')
+    cache.close()
+
+
+def worker(alias, requests, keys_per_request, key_space, latencies):
+    from django.core.cache import caches
+    cache = caches[alias]
+    rnd = random.Random()
+    for i in range(requests):
+        keys = ['key%d' % rnd.randrange(key_space) for _ in range(keys_per_request)]
+        started = time.perf_counter()
+        request(cache, keys)
+        latencies.append(time.perf_counter() - started)
+
+
+def run(alias, threads, requests, keys_per_request, key_space):
+    latencies = []
+    workers = [threading.Thread(target=worker, args=(alias, requests, keys_per_request, key_space, latencies))
+               for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return len(latencies) / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--server', help="memcached address, a fake server by default")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=500, help="requests per thread")
+    parser.add_argument('--keys', type=int, default=5, help="keys per request")
+    parser.add_argument('--key-space', type=int, default=1000)
+    options = parser.parse_args()
+
+    server = options.server
+    if server is None:
+        fake, server = fake_memcached.start_process()
+    settings.configure(CACHES=dict(
+        (name, {'BACKEND': 'cache_utils.group_backend.CacheClass', 'LOCATION': server, 'OPTIONS': config})
+        for name, config in CONFIGS))
+    django.setup()
+
+    print("%-12s %8s %12s %10s %10s" % ('client', 'threads', 'requests/s', 'p50 ms', 'p99 ms'))
+    for threads in options.threads:
+        for name, config in CONFIGS:
+            rate, p50, p99 = run(name, threads, options.requests, options.keys, options.key_space)
+            print("%-12s %8d %12.0f %10.3f %10.3f" % (name, threads, rate, p50 * 1000, p99 * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+Cost- and frequency-aware timeouts and admission for the `cached`
+decorator. An `AdaptivePolicy` keeps moving averages of how long a cached
+function takes to compute, how long its results take to fetch and store,
+how large they are and how often they are hit, and uses them to:
+
+* not cache results which are cheaper to compute than to fetch: such
+  functions are called directly, and once every `probe_every` calls the
+  cache is tried again, to keep measuring it;
+* store results for longer than the decorator's `timeout` if they are
+  expensive to compute and often hit, and shorter if they are cheap or
+  rarely hit, within `min_timeout` and `max_timeout`.
+
+Averages are kept per decorated function and are returned by its
+`cache_info()` under 'adaptive'.
+"""
+
+import threading
+
+
+class AdaptivePolicy(object):
+    """ Bounds and thresholds of adaptive caching, shared by any number of
+        cached functions::
+
+            @cached(60*15, adaptive=AdaptivePolicy(60, 60*60*6))
+            def report(month):
+                ...
+
+        `timeout` of the decorator is used for results which take
+        `cost_ratio` times longer to compute than to fetch and are hit half
+        of the time; it is scaled in proportion to the compute/fetch ratio
+        and by 0.5-1.5 for hit ratios of 0-1. Results are not cached while
+        they take less than `admit_ratio` times the fetch time to compute.
+
+        Nothing is decided before `warmup` results were computed; `weight`
+        is the weight of the latest measurement in moving averages.
+    """
+
+    def __init__(self, min_timeout, max_timeout, admit_ratio=1.0, cost_ratio=10.0, warmup=10, probe_every=20,
+                 weight=0.1):
+        if min_timeout > max_timeout:
+            raise ValueError("min_timeout must not be greater than max_timeout")
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.admit_ratio = admit_ratio
+        self.cost_ratio = cost_ratio
+        self.warmup = warmup
+        self.probe_every = probe_every
+        self.weight = weight
+
+    def tracker(self, timeout):
+        """ Returns the measurements of one function cached for `timeout` """
+        return Tracker(self, timeout)
+
+
+class Tracker(object):
+    """ Moving averages of a cached function and the decisions made of them.
+        Times are in seconds, sizes in bytes (of the values as they are
+        sent to the backend, pickled if cache_utils doesn't serialize them).
+    """
+
+    METRICS = ('compute_time', 'get_time', 'set_time', 'size')
+
+    def __init__(self, policy, timeout):
+        self.policy = policy
+        self.base_timeout = timeout
+        self.compute_time = None
+        self.get_time = None
+        self.set_time = None
+        self.size = None
+        self.hit_ratio = None
+        self.hits = 0
+        self.misses = 0
+        self.computed = 0
+        self.bypassed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def _average(self, name, value):
+        old = getattr(self, name)
+        setattr(self, name, value if old is None else old + self.policy.weight * (value - old))
+
+    def observe(self, metric, value):
+        with self._lock:
+            self._average(metric, value)
+            if metric == 'compute_time':
+                self.computed += 1
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+            self._average('hit_ratio', 1.0)
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+            self._average('hit_ratio', 0.0)
+
+    def _warm(self):
+        return self.computed >= self.policy.warmup and self.get_time is not None
+
+    def admits(self):
+        """ Returns False if results are cheaper to compute than to fetch """
+        if not self._warm():
+            return True
+        return self.compute_time >= self.policy.admit_ratio * self.get_time
+
+    def admit(self):
+        """ Returns True if a computed result should be stored """
+        if self.admits():
+            return True
+        with self._lock:
+            self.rejected += 1
+        return False
+
+    def bypass(self):
+        """ Returns True if the cache should not be tried for a call: results
+            are not admitted and it is not the turn of a probe.
+        """
+        if self.admits():
+            return False
+        with self._lock:
+            self.bypassed += 1
+            return self.bypassed % self.policy.probe_every != 0
+
+    def timeout(self):
+        """ Returns the timeout to store a result with """
+        policy = self.policy
+        if not self.base_timeout or not self._warm():
+            return self.base_timeout
+        hit_ratio = 0.5 if self.hit_ratio is None else self.hit_ratio
+        cost = self.compute_time / max(self.get_time, 1e-6)
+        timeout = self.base_timeout * cost / policy.cost_ratio * (0.5 + hit_ratio)
+        return int(min(max(timeout, policy.min_timeout), policy.max_timeout))
+
+    def as_dict(self):
+        info = dict((metric, getattr(self, metric)) for metric in self.METRICS)
+        info.update({
+            'hit_ratio': self.hit_ratio,
+            'hits': self.hits,
+            'misses': self.misses,
+            'computed': self.computed,
+            'bypassed': self.bypassed,
+            'rejected': self.rejected,
+            'admitted': self.admits(),
+            'timeout': self.timeout(),
+        })
+        return info
@@ -3,6 +3,8 @@ import sys
 
 from django.core.cache import caches
 
+from cache_utils import metrics
+
 
 logger = logging.getLogger("cache_utils")
 
@@ -18,12 +20,18 @@ def get(key, backend='default'):
     # Wrapper to get from cache.
     cache = caches[backend]
     key = _generate_key(key)
+    started = metrics.clock()
     val = cache.get(key)
+    metrics.record_time(__name__, 'get_time', started)
 
     if val:
-        logger.debug("Cache HIT: %s" % key)
+        logger.debug("Cache HIT: %s", key)
+        if metrics.enabled:
+            metrics.record(__name__, 'hit')
     else:
-        logger.debug("Cache MISS: %s" % key)
+        logger.debug("Cache MISS: %s", key)
+        if metrics.enabled:
+            metrics.record(__name__, 'miss')
 
     return val
 
@@ -33,8 +41,11 @@ def set(key, value, backend='default'):
     cache = caches[backend]
     key = _generate_key(key)
 
+    started = metrics.clock()
     val = cache.set(key, value)
-    logger.debug("Cache SET: %s - Size: %s" % (key, sys.getsizeof(value)))
+    metrics.record_time(__name__, 'set_time', started)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Cache SET: %s - Size: %s", key, sys.getsizeof(value))
 
     return val
 
@@ -45,5 +56,5 @@ def delete(key, backend='default'):
     key = _generate_key(key)
 
     val = cache.delete(key)
-    logger.debug("Cache DELETE: %s" % key)
+    logger.debug("Cache DELETE: %s", key)
     return val
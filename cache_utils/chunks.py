@@ -0,0 +1,68 @@
+"""
+Storage of serialized values larger than the memcached item size limit.
+
+A large value is split into numbered chunks stored under keys derived from
+a random token, and a small manifest (chunk count, length, crc32 checksum
+and the token) is stored under the value's own key. A value is read back
+only if all of its chunks are found and the checksum matches; anything else
+is a cache miss. Old chunks are never deleted explicitly, they expire with
+the timeout they were stored with.
+"""
+
+import struct
+import uuid
+import zlib
+
+from cache_utils.utils import sanitize_memcached_key
+
+
+# memcached refuses items larger than 1MB by default, including the key and
+# item header, so leave some room for them
+DEFAULT_CHUNK_SIZE = 1000 * 1000
+
+MANIFEST_MAGIC = 0xCB
+_CHUNK_PREFIX = "_chunk::"
+
+# magic, chunk count, total length, crc32 and the token
+_manifest = struct.Struct('<BIII16s')
+
+
+def is_manifest(value):
+    return (isinstance(value, bytes) and len(value) == _manifest.size
+            and value[0] == MANIFEST_MAGIC)
+
+
+def _chunk_key(token, index):
+    return sanitize_memcached_key("%s%s:%d" % (_CHUNK_PREFIX, token.hex(), index))
+
+
+def split(data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """ Returns the manifest of data and a dict of its chunks by key """
+    token = uuid.uuid4().bytes
+    count = (len(data) + chunk_size - 1) // chunk_size
+    manifest = _manifest.pack(MANIFEST_MAGIC, count, len(data), zlib.crc32(data), token)
+    view = memoryview(data)
+    chunks = dict(
+        (_chunk_key(token, i), bytes(view[i * chunk_size:(i + 1) * chunk_size]))
+        for i in range(count)
+    )
+    return manifest, chunks
+
+
+def chunk_keys(manifest):
+    _magic, count, _length, _checksum, token = _manifest.unpack(manifest)
+    return [_chunk_key(token, i) for i in range(count)]
+
+
+def join(manifest, parts):
+    """ Returns the data described by manifest assembled from the list of
+        its chunks in `chunk_keys` order, or None if some chunks are
+        missing or the checksum doesn't match.
+    """
+    _magic, count, length, checksum, token = _manifest.unpack(manifest)
+    if len(parts) != count or not all(isinstance(part, bytes) for part in parts):
+        return None
+    data = b"".join(parts)
+    if len(data) != length or zlib.crc32(data) != checksum:
+        return None
+    return data
@@ -1,46 +1,249 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
+import inspect
 import logging
-from hashlib import sha256
+import pickle
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 
-from cache_utils.utils import _cache_key, _func_info, _func_type, sanitize_memcached_key
+from cache_utils import chunks, instances, local, locks, memo, metrics
+from cache_utils.refresh import Envelope, refresher
+from cache_utils.serializers import Codec, get_codec
+from cache_utils.utils import _func_info, _func_type, make_key_builder, sanitize_memcached_key
 from django.core.cache import caches
-from django.db import models
-from django.utils.encoding import smart_str
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models, transaction
 
 from django.utils.functional import wraps
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+try:
+    from asyncio import get_running_loop
+except ImportError:  # Python < 3.7, where get_event_loop returns the running loop in coroutines
+    from asyncio import get_event_loop as get_running_loop
 
 logger = logging.getLogger("cache_utils")
 
 
+# Model and tag generation tokens are stored under these prefixes in the
+# 'default' cache for as long as memcached allows.
+_MODEL_VERSION_PREFIX = "_model::"
+_TAG_VERSION_PREFIX = "_tag::"
+MODEL_VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+
 class CacheRegistry(object):
-    def register_key(self, model_list, key):
+    """ Keeps a generation token for every model used in `model_list` and
+        every tag returned by `tags`. Tokens are folded into cache keys, so
+        a model or a tag is invalidated in O(1) by dropping its token: keys
+        built with the old token are never read again and expire on their
+        own.
+
+        Models are registered when a function is decorated with them in
+        `model_list`; only registered models get `post_save` and
+        `post_delete` receivers. Modules with such functions should be
+        imported (e.g. from `AppConfig.ready`) in every process that saves
+        those models.
+
+        It also keeps the full names of cached functions known to this
+        process; methods are known once they are called.
+    """
+
+    def __init__(self):
+        self.models = set()
+        self.functions = {}
+        self._deferred = threading.local()
+
+    def register_function(self, name, wrapper):
+        self.functions[name] = wrapper
+
+    def register_model(self, model):
+        if model in self.models:
+            return
+        self.models.add(model)
+        models.signals.post_save.connect(invalidate_model, sender=model)
+        models.signals.post_delete.connect(invalidate_model, sender=model)
+
+    def _version_key(self, model):
+        return _MODEL_VERSION_PREFIX + model._meta.label_lower
+
+    def _tag_key(self, tag):
+        return sanitize_memcached_key(_TAG_VERSION_PREFIX + str(tag))
+
+    def _version_keys(self, model_list, tags):
+        return [self._version_key(model) for model in model_list] + [self._tag_key(tag) for tag in tags]
+
+    def get_versions(self, model_list, tags=()):
+        """ Returns a dict of generation tokens of models and tags, fetched
+            with a single `get_many`.
+        """
         cache_backend = caches['default']
+        version_keys = self._version_keys(model_list, tags)
+        if not version_keys:
+            return {}
+        versions = cache_backend.get_many(version_keys)
+        for version_key in version_keys:
+            if version_key not in versions:
+                version = uuid.uuid4().hex[:16]
+                if not cache_backend.add(version_key, version, MODEL_VERSION_TIMEOUT):
+                    # another process has just created the token
+                    version = cache_backend.get(version_key) or version
+                versions[version_key] = version
+        return versions
+
+    def make_key(self, key, model_list, versions=None, tags=()):
+        """ Returns key with generation tokens of models and tags folded in.
+            Pass `versions` returned by `get_versions` to avoid fetching
+            them again when building many keys.
+        """
+        if not model_list and not tags:
+            return key
+        if versions is None:
+            versions = self.get_versions(model_list, tags)
+        version_keys = self._version_keys(model_list, tags)
+        return sanitize_memcached_key("%s:%s" % (key, "-".join(versions[k] for k in version_keys)))
+
+    def invalidate(self, model):
+        """ Invalidates cached results depending on model, or records the
+            model for later if invalidation is deferred in this thread.
+        """
+        if model not in self.models:
+            return
+        pending = getattr(self._deferred, 'models', None)
+        if pending is not None:
+            pending.add(model)
+        else:
+            self.invalidate_now([model])
+
+    def defer_instances(self, model, pks):
+        """ Records instances for `instances.invalidate_instances` if
+            invalidation is deferred in this thread, returns whether it is.
+        """
+        pending = getattr(self._deferred, 'instances', None)
+        if pending is None:
+            return False
+        pending.setdefault(model, set()).update(pks)
+        return True
 
+    def invalidate_now(self, model_list, instance_pks=None):
+        """ Invalidates models and instances given as {model: pks}, with one
+            `delete_many` per cache.
+        """
+        if not model_list and not instance_pks:
+            return
+        keys = instances.instance_keys(instance_pks or {})
+        if model_list:
+            keys.setdefault('default', []).extend(self._version_key(model) for model in model_list)
+        for backend, backend_keys in keys.items():
+            caches[backend].delete_many(backend_keys)
         for model in model_list:
-            model_key = model._meta.label_lower
-            registered_keys = cache_backend.get(model_key)
-            if not registered_keys:
-                cache_backend.set(model_key, [key])
-            else:
-                if key not in registered_keys:
-                    registered_keys.append(key)
-                cache_backend.set(model_key, registered_keys)
+            local.invalidate_model(model)
+        memo.clear()
 
-    def retrieve_keys(self, model):
-        cache_backend = caches['default']
-        return cache_backend.get(model._meta.label_lower)
+    def invalidate_tags(self, tags):
+        tags = list(tags)
+        if not tags:
+            return
+        caches['default'].delete_many([self._tag_key(tag) for tag in tags])
+        local.invalidate_tagged()
+        memo.clear()
+
+    @contextmanager
+    def defer(self, on_commit=False, using=None):
+        if getattr(self._deferred, 'models', None) is not None:
+            # nested block, the outermost one invalidates
+            yield
+            return
+        self._deferred.models = pending = set()
+        self._deferred.instances = pending_instances = {}
+        try:
+            yield
+        finally:
+            self._deferred.models = self._deferred.instances = None
+            if on_commit:
+                transaction.on_commit(lambda: self.invalidate_now(pending, pending_instances), using=using)
+            else:
+                self.invalidate_now(pending, pending_instances)
 
 
 registry = CacheRegistry()
 
 
-def cached(timeout, group=None, backend='default', key=None, model_list=[], hashed=False, object_attrs=None):
+class _CachedNone(object):
+    """ Stored in place of None results when negative caching is on, so a
+        cached None can be told apart from a missing key.
+    """
+
+    def __reduce__(self):
+        return 'CACHED_NONE'
+
+    def __repr__(self):
+        return 'CACHED_NONE'
+
+
+CACHED_NONE = _CachedNone()
+
+
+def _is_negative(value):
+    """ None and empty results are cached with `negative_timeout` """
+    if value is None:
+        return True
+    try:
+        return len(value) == 0
+    except TypeError:
+        return False
+
+
+def _result(value):
+    return None if value is CACHED_NONE else value
+
+
+class _BackendProxy(object):
+    """ Looks the cache backend up on every use: django keeps a backend
+        instance per thread because memcached clients are not thread-safe.
+    """
+
+    def __init__(self, alias):
+        self._alias = alias
+
+    def __getattr__(self, name):
+        return getattr(caches[self._alias], name)
+
+
+def _async_method(cache_backend, name):
+    """ Returns the async variant of a cache backend method. Backends without
+        native async support get the sync method run by `sync_to_async`.
+    """
+    def method(*args, **kwargs):
+        backend_method = getattr(cache_backend, 'a' + name, None)
+        if backend_method is None:
+            backend_method = sync_to_async(getattr(cache_backend, name), thread_sensitive=True)
+        return backend_method(*args, **kwargs)
+    return method
+
+
+# references to running background revalidation tasks of async functions
+_background_tasks = set()
+
+
+def cached(timeout, group=None, backend='default', key=None, model_list=[], hashed=False, object_attrs=None,
+           local_ttl=None, local_maxsize=1000, single_flight=False, lock=False, lock_timeout=30,
+           stale_ttl=None, refresh='sync', negative_timeout=None, serializer=None,
+           chunk_size=None, tags=None, key_format=None, adaptive=None):
     """ Caching decorator. Can be applied to function, method or classmethod.
     Supports bulk cache invalidation and invalidation for exact parameter
     set. Cache keys are human-readable because they are constructed from
     callable's full name and arguments and then sanitized to make
-    memcached happy.
+    memcached happy. With `key_format='compact'` keys are short digests
+    instead, see `utils.make_key_builder`; memcached stores the key in
+    every item, so this saves memory when there are many small values.
+    Set CACHE_UTILS_COMPACT_KEY_MAP in development to look the readable
+    keys up with `utils.readable_key`.
 
     It can be used with or without group_backend. Without group_backend
     bulk invalidation is not supported.
@@ -48,51 +251,562 @@ def cached(timeout, group=None, backend='default', key=None, model_list=[], hash
     Wrapped callable gets `invalidate` methods. Call `invalidate` with
     same arguments as function and the result for these arguments will be
     invalidated.
-    """
-    if key:
-        def test(*args, **kwargs):
-            args = list(args)
-            args[0] = key
-            return sanitize_memcached_key(_cache_key(*args, **kwargs))
-        _get_key = test
-    else:
-        if hashed:
-            def _get_hashed_key(*args, **kwargs):
-                key = _cache_key(*args, **kwargs)
-                return sha256(smart_str(key).encode()).hexdigest()
-            _get_key = _get_hashed_key
-        else:
-            _get_key = lambda *args, **kwargs: sanitize_memcached_key(_cache_key(*args, **kwargs))
 
+    Wrapped callable also gets `get_many` and `map` methods which look up
+    results for many argument sets at once using a single `get_many` and a
+    single `set_many` backend call.
+
+    Pass `local_ttl` (in seconds) to keep up to `local_maxsize` recent
+    results in a process-local LRU tier in front of the cache backend.
+    Values in the local tier may be up to `local_ttl` seconds stale with
+    respect to invalidations made by other processes. Hit/miss counters
+    for both tiers are returned by `cache_info`.
+
+    Dog-pile prevention works with any backend. With `single_flight`
+    concurrent misses of the same key in a process share one call of the
+    function. `lock` additionally takes a lease on the key with `add` so
+    only one process recalculates it; other processes poll for the result
+    for up to `lock_timeout` seconds before recalculating it themselves.
+
+    With `stale_ttl` values are kept for `stale_ttl` more seconds after
+    `timeout` and served stale while they are revalidated. With
+    `refresh='sync'` the first caller which sees a stale value recalculates
+    it; with `refresh='background'` all callers get the stale value at once
+    and it is recalculated in a bounded thread pool. Either way a key is
+    revalidated at most once at a time in a process, and across processes
+    too if `lock` is set.
+
+    `tags` is a list of tags or a callable which returns tags for the
+    arguments the key is built from (without self/cls), e.g.
+    ``tags=lambda user_id: ['user:%s' % user_id]``. `invalidate_tags`
+    invalidates results with any of the given tags in O(1) per tag on any
+    backend.
+
+    None results are not cached unless `negative_timeout` is given. Then
+    None and empty results (like `[]`, `{}` or `''`; `0` and `False` are
+    not empty) are cached for `negative_timeout` seconds, which is usually
+    shorter than `timeout`.
+
+    `serializer` ('pickle', 'json', 'msgpack' or a `serializers.Codec`)
+    makes values be stored as compact bytes, compressed when they are
+    large. The backend then only has to store bytes. Values serialized to
+    more than `chunk_size` bytes (e.g. `chunks.DEFAULT_CHUNK_SIZE`) are
+    split into chunks written with one `set_many` and read with one
+    `get_many`, to fit the memcached item size limit; values are pickled
+    if `chunk_size` is given without `serializer`.
+
+    Hits, misses, stale serves, compute time, backend latency and value
+    sizes are reported to the sinks of `cache_utils.metrics`; `stats`
+    returns the ones kept by its in-memory sink.
+
+    `adaptive` (an `adaptive.AdaptivePolicy`) makes the timeout depend on
+    how expensive results are to compute and how often they are hit, and
+    results which are cheaper to compute than to fetch not be cached. Its
+    measurements are returned by `cache_info`.
+
+    With `middleware.RequestMemoMiddleware` results are also remembered
+    until the end of the request, see `cache_utils.memo`.
+
+    `async def` functions are supported with the async cache API (`aget`,
+    `aset`, ...). Concurrent awaiters of the same missing key share one
+    call. They get `ainvalidate`, `aforce_recalc`, `arequire_cache` and
+    `aget_cache_key` methods; synchronous functions get them too.
+    """
+    if refresh not in ('sync', 'background'):
+        raise ValueError("refresh must be 'sync' or 'background'")
     if group:
         backend_kwargs = {'group': group}
     else:
         backend_kwargs = {}
 
-    cache_backend = caches[backend]
+    cache_backend = _BackendProxy(backend)
+    codec = get_codec(serializer)
+    if chunk_size and codec is None:
+        codec = Codec()
+    for model in model_list:
+        registry.register_model(model)
 
     def _cached(func):
         func_type = _func_type(func)
+        _get_key = make_key_builder(func_type, key, hashed, object_attrs, key_format)
+        # invalidate and get_cache_key are called without self/cls
+        _get_function_key = make_key_builder('function', key, hashed, object_attrs, key_format)
+        local_cache = local.LocalCache(local_ttl, local_maxsize, group, model_list,
+                                       tagged=tags is not None) if local_ttl else None
+        backend_stats = local.TierStats()
+        tracker = adaptive.tracker(timeout) if adaptive is not None else None
+        flights = locks.SingleFlight() if (single_flight or lock) else None
 
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            full_name(*args)
+        def _tags(args, kwargs, bound=True):
+            """ Returns tags of a call. Pass `bound=False` for arguments
+                without self/cls.
+            """
+            if tags is None:
+                return ()
+            if not callable(tags):
+                return tags
+            if bound and func_type != 'function':
+                args = args[1:]
+            return list(tags(*args, **kwargs))
+
+        def _local_get(key):
+            """ Returns the value remembered for the current request or kept
+                in the local tier, or None.
+            """
+            request_memo = memo.current()
+            if request_memo is not None:
+                value = request_memo.get(key)
+                if value is not None:
+                    logger.debug("Request memo HIT: %s", key)
+                    _record('memo_hit')
+                    return value
+            if local_cache is not None:
+                value = local_cache.get(key)
+                if value is not None:
+                    logger.debug("Local cache HIT: %s", key)
+                    _record('local_hit')
+                    if request_memo is not None:
+                        request_memo[key] = value
+                    return value
+            return None
+
+        def _local_set(key, value):
+            request_memo = memo.current()
+            if request_memo is not None and value is not None:
+                request_memo[key] = value
+            if local_cache is not None:
+                local_cache.set(key, value)
+
+        def _local_delete(key):
+            request_memo = memo.current()
+            if request_memo is not None:
+                request_memo.pop(key, None)
+            if local_cache is not None:
+                local_cache.delete(key)
+
+        def _record(metric, value=1):
+            if metrics.enabled:
+                metrics.record(wrapper._full_name, metric, value)
+
+        def _hit():
+            backend_stats.hit()
+            if tracker is not None:
+                tracker.hit()
+            _record('hit')
+
+        def _miss():
+            backend_stats.miss()
+            if tracker is not None:
+                tracker.miss()
+            _record('miss')
+
+        def _clock():
+            """ Returns the start time for `_record_time`, None if neither
+                metrics nor the adaptive policy need it.
+            """
+            return time.perf_counter() if tracker is not None else metrics.clock()
+
+        def _record_time(metric, started):
+            if started is None:
+                return
+            elapsed = time.perf_counter() - started
+            if tracker is not None:
+                tracker.observe(metric, elapsed)
+            if metrics.enabled:
+                metrics.record(wrapper._full_name, metric, elapsed)
+
+        def _call(args, kwargs):
+            started = _clock()
+            value = func(*args, **kwargs)
+            _record_time('compute_time', started)
+            return value
+
+        def _bypass():
+            """ Returns True if results of the adaptive policy are not
+                cached and the call should not try the cache.
+            """
+            if tracker is None or not tracker.bypass():
+                return False
+            _record('bypass')
+            return True
+
+        def _admit(key):
+            if tracker is None or tracker.admit():
+                return True
+            logger.debug("Cache SKIP: %s", key)
+            _record('skip')
+            return False
+
+        def _pack(value):
+            """ Returns (value, timeout) to store a function result with """
+            value_timeout = timeout if tracker is None else tracker.timeout()
+            if negative_timeout is not None and _is_negative(value):
+                value_timeout = negative_timeout
+                if value is None:
+                    value = CACHED_NONE
+            return value, value_timeout
+
+        def _prepare(key, value):
+            """ Returns a function result as it is cached, the value to send
+                to the backend, its backend timeout and a dict of chunks to
+                store along with it.
+            """
+            value, value_timeout = _pack(value)
+            backend_value, chunk_values = value, {}
+            if codec is not None and value is not CACHED_NONE:
+                backend_value = codec.dumps(value)
+            if metrics.enabled or tracker is not None:
+                # values which are not serialized here are measured pickled
+                size = len(backend_value) if isinstance(backend_value, bytes) else len(pickle.dumps(value, -1))
+                if tracker is not None:
+                    tracker.observe('size', size)
+                if metrics.enabled:
+                    _record('size', size)
+                    expiry = None if value_timeout is None else value_timeout + (stale_ttl or 0)
+                    metrics.record_key(wrapper._full_name, key, size, expiry)
+            if chunk_size and isinstance(backend_value, bytes) and len(backend_value) > chunk_size:
+                backend_value, chunk_values = chunks.split(backend_value, chunk_size)
+            if stale_ttl and value_timeout:
+                backend_value = Envelope(backend_value, time.time() + value_timeout)
+                value_timeout += stale_ttl
+            return value, backend_value, value_timeout, chunk_values
 
-            # try to get the value from cache
-            key = _get_key(wrapper._full_name, func_type, args, kwargs, object_attrs)
+        def _chunk_keys(value):
+            """ Returns keys of the chunks of a value read from the backend """
+            if not chunk_size:
+                return []
+            if isinstance(value, Envelope):
+                value = value.value
+            return chunks.chunk_keys(value) if chunks.is_manifest(value) else []
+
+        def _load(value, chunk_values=None):
+            """ Decodes a value read from the backend. Chunked values are
+                assembled from `chunk_values`, they are None if a chunk is
+                missing.
+            """
+            if codec is None:
+                return value
+            if isinstance(value, Envelope):
+                loaded = _load(value.value, chunk_values)
+                return None if loaded is None else Envelope(loaded, value.soft_expiry)
+            if chunks.is_manifest(value):
+                chunk_values = chunk_values or {}
+                value = chunks.join(value, [chunk_values.get(key) for key in chunks.chunk_keys(value)])
+            if isinstance(value, bytes):
+                return codec.loads(value)
+            return value
+
+        def _fetch(key):
+            started = _clock()
             value = cache_backend.get(key, **backend_kwargs)
+            keys = _chunk_keys(value)
+            chunk_values = cache_backend.get_many(keys, **backend_kwargs) if keys else None
+            _record_time('get_time', started)
+            return _load(value, chunk_values)
 
-            # in case of cache miss recalculate the value and put it to the cache
-            if value is None:
-                logger.debug("Cache MISS: %s" % key)
-                value = func(*args, **kwargs)
-                cache_backend.set(key, value, timeout, **backend_kwargs)
-                logger.debug("Cache SET: %s" % key)
+        def _store(key, value):
+            """ Stores a function result, returns what was stored """
+            if not _admit(key):
+                return _pack(value)[0]
+            value, backend_value, backend_timeout, chunk_values = _prepare(key, value)
+            started = _clock()
+            if chunk_values:
+                chunk_values[key] = backend_value
+                cache_backend.set_many(chunk_values, backend_timeout, **backend_kwargs)
             else:
-                logger.debug("Cache HIT: %s" % key)
-            registry.register_key(model_list, key)
+                cache_backend.set(key, backend_value, backend_timeout, **backend_kwargs)
+            _record_time('set_time', started)
+            logger.debug("Cache SET: %s", key)
+            return value
+
+        def _store_many(data):
+            if tracker is not None and not tracker.admit():
+                logger.debug("Cache SKIP: %d values", len(data))
+                _record('skip')
+                return
+            by_timeout = {}
+            for key, value in data.items():
+                value, backend_value, backend_timeout, chunk_values = _prepare(key, value)
+                values = by_timeout.setdefault(backend_timeout, {})
+                values.update(chunk_values)
+                values[key] = backend_value
+            started = _clock()
+            for backend_timeout, values in by_timeout.items():
+                cache_backend.set_many(values, backend_timeout, **backend_kwargs)
+            _record_time('set_time', started)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Cache SET: %s", ", ".join(data))
+
+        def _peek(key):
+            value = _fetch(key)
+            return value.value if isinstance(value, Envelope) else value
+
+        def _recalculate(key, args, kwargs):
+            """ Calls the function for a missed key and stores its result """
+            lease = None
+            if lock:
+                lease = locks.Lease(cache_backend, key, lock_timeout)
+                if not lease.acquire():
+                    logger.debug("Cache LOCKED: %s", key)
+                    value = lease.wait(lambda: _peek(key))
+                    if value is not None:
+                        return value
+            try:
+                value = _store(key, _call(args, kwargs))
+            finally:
+                if lease is not None:
+                    lease.release()
             return value
 
+        def _revalidate(key, local_key, args, kwargs):
+            """ Recalculates a stale value, returns None if it is being
+                revalidated by another process.
+            """
+            lease = None
+            if lock:
+                lease = locks.Lease(cache_backend, key, lock_timeout)
+                if not lease.acquire():
+                    return None
+            try:
+                value = _store(key, _call(args, kwargs))
+            finally:
+                if lease is not None:
+                    lease.release()
+            _local_set(local_key, value)
+            return value
+
+        def _unwrap(key, local_key, value, args, kwargs):
+            """ Returns the value read from the backend, revalidating it if
+                it is past its soft expiry.
+            """
+            if not isinstance(value, Envelope):
+                return value
+            value, soft_expiry = value
+            if time.time() < soft_expiry:
+                return value
+            logger.debug("Cache STALE: %s", key)
+            _record('stale')
+            if refresh == 'background':
+                refresher.submit(key, lambda: _revalidate(key, local_key, args, kwargs))
+                return value
+            if not refresher.claim(key):
+                return value
+            try:
+                fresh_value = _revalidate(key, local_key, args, kwargs)
+            finally:
+                refresher.release(key)
+            return value if fresh_value is None else fresh_value
+
+        is_async = inspect.iscoroutinefunction(func)
+        if is_async and sync_to_async is None:
+            raise ImproperlyConfigured("Caching async functions requires Django >= 3.0")
+        if is_async:
+            _aget = _async_method(cache_backend, 'get')
+            _aset = _async_method(cache_backend, 'set')
+            _adelete = _async_method(cache_backend, 'delete')
+            _aget_many = _async_method(cache_backend, 'get_many')
+            _aset_many = _async_method(cache_backend, 'set_many')
+            # in-flight calls of missing keys, shared by concurrent awaiters
+            _inflight = {}
+
+            async def _amake_key(key, call_tags):
+                if not model_list and not call_tags:
+                    return key
+                return await sync_to_async(registry.make_key, thread_sensitive=True)(key, model_list, tags=call_tags)
+
+            async def _acall(args, kwargs):
+                started = _clock()
+                value = await func(*args, **kwargs)
+                _record_time('compute_time', started)
+                return value
+
+            async def _afetch(key):
+                started = _clock()
+                value = await _aget(key, **backend_kwargs)
+                keys = _chunk_keys(value)
+                chunk_values = (await _aget_many(keys, **backend_kwargs)) if keys else None
+                _record_time('get_time', started)
+                return _load(value, chunk_values)
+
+            async def _astore(key, value):
+                if not _admit(key):
+                    return _pack(value)[0]
+                value, backend_value, backend_timeout, chunk_values = _prepare(key, value)
+                started = _clock()
+                if chunk_values:
+                    chunk_values[key] = backend_value
+                    await _aset_many(chunk_values, backend_timeout, **backend_kwargs)
+                else:
+                    await _aset(key, backend_value, backend_timeout, **backend_kwargs)
+                _record_time('set_time', started)
+                logger.debug("Cache SET: %s", key)
+                return value
+
+            async def _apeek(key):
+                value = await _afetch(key)
+                return value.value if isinstance(value, Envelope) else value
+
+            async def _arecalculate(key, args, kwargs):
+                lease = None
+                if lock:
+                    lease = locks.Lease(cache_backend, key, lock_timeout)
+                    if not await sync_to_async(lease.acquire, thread_sensitive=True)():
+                        logger.debug("Cache LOCKED: %s", key)
+                        value = await lease.async_wait(lambda: _apeek(key))
+                        if value is not None:
+                            return value
+                try:
+                    value = await _astore(key, await _acall(args, kwargs))
+                finally:
+                    if lease is not None:
+                        await sync_to_async(lease.release, thread_sensitive=True)()
+                return value
+
+            async def _acoalesced(key, args, kwargs):
+                loop = get_running_loop()
+                inflight_key = (id(loop), key)
+                task = _inflight.get(inflight_key)
+                if task is None:
+                    task = loop.create_task(_arecalculate(key, args, kwargs))
+                    _inflight[inflight_key] = task
+                    task.add_done_callback(lambda task: _inflight.pop(inflight_key, None))
+                # one cancelled awaiter must not cancel the call for the others
+                return await asyncio.shield(task)
+
+            async def _arevalidate(key, local_key, args, kwargs):
+                lease = None
+                if lock:
+                    lease = locks.Lease(cache_backend, key, lock_timeout)
+                    if not await sync_to_async(lease.acquire, thread_sensitive=True)():
+                        return None
+                try:
+                    value = await _astore(key, await _acall(args, kwargs))
+                finally:
+                    if lease is not None:
+                        await sync_to_async(lease.release, thread_sensitive=True)()
+                _local_set(local_key, value)
+                return value
+
+            async def _arevalidate_in_background(key, local_key, args, kwargs):
+                try:
+                    await _arevalidate(key, local_key, args, kwargs)
+                except Exception:
+                    logger.exception("Cache REFRESH failed: %s", key)
+                finally:
+                    refresher.release(key)
+
+            async def _aunwrap(key, local_key, value, args, kwargs):
+                if not isinstance(value, Envelope):
+                    return value
+                value, soft_expiry = value
+                if time.time() < soft_expiry:
+                    return value
+                logger.debug("Cache STALE: %s", key)
+                _record('stale')
+                if not refresher.claim(key):
+                    return value
+                if refresh == 'background':
+                    task = asyncio.ensure_future(_arevalidate_in_background(key, local_key, args, kwargs))
+                    _background_tasks.add(task)
+                    task.add_done_callback(_background_tasks.discard)
+                    return value
+                try:
+                    fresh_value = await _arevalidate(key, local_key, args, kwargs)
+                finally:
+                    refresher.release(key)
+                return value if fresh_value is None else fresh_value
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                full_name(*args)
+
+                key = _get_key(wrapper._full_name, args, kwargs)
+                value = _local_get(key)
+                if value is not None:
+                    return _result(value)
+                local_key = key
+                if _bypass():
+                    value = _pack(await _acall(args, kwargs))[0]
+                    _local_set(local_key, value)
+                    return _result(value)
+                key = await _amake_key(key, _tags(args, kwargs))
+                value = await _aunwrap(key, local_key, await _afetch(key), args, kwargs)
+
+                if value is None:
+                    _miss()
+                    logger.debug("Cache MISS: %s", key)
+                    value = await _acoalesced(key, args, kwargs)
+                else:
+                    _hit()
+                    logger.debug("Cache HIT: %s", key)
+                _local_set(local_key, value)
+                return _result(value)
+
+            async def ainvalidate(*args, **kwargs):
+                if not hasattr(wrapper, '_full_name'):
+                    return
+                key = _get_function_key(wrapper._full_name, args, kwargs)
+                _local_delete(key)
+                key = await _amake_key(key, _tags(args, kwargs, bound=False))
+                await _adelete(key, **backend_kwargs)
+                metrics.forget_key(wrapper._full_name, key)
+                logger.debug("Cache DELETE: %s", key)
+
+            async def aforce_recalc(*args, **kwargs):
+                full_name(*args)
+                local_key = _get_key(wrapper._full_name, args, kwargs)
+                key = await _amake_key(local_key, _tags(args, kwargs))
+                value = await _astore(key, await _acall(args, kwargs))
+                _local_set(local_key, value)
+                return _result(value)
+
+            async def arequire_cache(*args, **kwargs):
+                full_name(*args)
+                key = _get_key(wrapper._full_name, args, kwargs)
+                value = _local_get(key)
+                if value is None:
+                    value = await _apeek(await _amake_key(key, _tags(args, kwargs)))
+                if value is None:
+                    logger.info("Could not find required cache %s", key)
+                    raise NoCachedValueException
+                return _result(value)
+
+            async def aget_cache_key(*args, **kwargs):
+                full_name(*args)
+                key = _get_function_key(wrapper._full_name, args, kwargs)
+                return await _amake_key(key, _tags(args, kwargs, bound=False))
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                full_name(*args)
+
+                # try to get the value from cache
+                key = _get_key(wrapper._full_name, args, kwargs)
+                value = _local_get(key)
+                if value is not None:
+                    return _result(value)
+                local_key = key
+                if _bypass():
+                    value = _pack(_call(args, kwargs))[0]
+                    _local_set(local_key, value)
+                    return _result(value)
+                key = registry.make_key(key, model_list, tags=_tags(args, kwargs))
+                value = _unwrap(key, local_key, _fetch(key), args, kwargs)
+
+                # in case of cache miss recalculate the value and put it to the cache
+                if value is None:
+                    _miss()
+                    logger.debug("Cache MISS: %s", key)
+                    if flights is not None:
+                        value = flights.do(key, lambda: _recalculate(key, args, kwargs))
+                    else:
+                        value = _recalculate(key, args, kwargs)
+                else:
+                    _hit()
+                    logger.debug("Cache HIT: %s", key)
+                _local_set(local_key, value)
+                return _result(value)
+
         def invalidate(*args, **kwargs):
             """
             Invalidates cache result for function called with passed arguments
@@ -100,9 +814,12 @@ def cached(timeout, group=None, backend='default', key=None, model_list=[], hash
             if not hasattr(wrapper, '_full_name'):
                 return
 
-            key = _get_key(wrapper._full_name, 'function', args, kwargs)
+            key = _get_function_key(wrapper._full_name, args, kwargs)
+            _local_delete(key)
+            key = registry.make_key(key, model_list, tags=_tags(args, kwargs, bound=False))
             cache_backend.delete(key, **backend_kwargs)
-            logger.debug("Cache DELETE: %s" % key)
+            metrics.forget_key(wrapper._full_name, key)
+            logger.debug("Cache DELETE: %s", key)
 
         def force_recalc(*args, **kwargs):
             """
@@ -110,40 +827,215 @@ def cached(timeout, group=None, backend='default', key=None, model_list=[], hash
             """
             full_name(*args)
 
-            key = _get_key(wrapper._full_name, func_type, args, kwargs)
-            value = func(*args, **kwargs)
-            cache_backend.set(key, value, timeout, **backend_kwargs)
-            return value
+            local_key = _get_key(wrapper._full_name, args, kwargs)
+            key = registry.make_key(local_key, model_list, tags=_tags(args, kwargs))
+            value = _store(key, _call(args, kwargs))
+            _local_set(local_key, value)
+            return _result(value)
 
         def full_name(*args):
             # full name is stored as attribute on first call
             if not hasattr(wrapper, '_full_name'):
                 name, _args = _func_info(func, args)
                 wrapper._full_name = name
+                registry.register_function(name, wrapper)
 
         def require_cache(*args, **kwargs):
             """
             Only pull from cache, do not attempt to calculate
             """
             full_name(*args)
-            key = _get_key(wrapper._full_name, func_type, args, kwargs)
-            logger.debug("Require cache %s" % key)
-            value = cache_backend.get(key, **backend_kwargs)
-            if not value:
-                logger.info("Could not find required cache %s" % key)
+            key = _get_key(wrapper._full_name, args, kwargs)
+            logger.debug("Require cache %s", key)
+            value = _local_get(key)
+            if value is None:
+                value = _peek(registry.make_key(key, model_list, tags=_tags(args, kwargs)))
+            if value is None:
+                logger.info("Could not find required cache %s", key)
                 raise NoCachedValueException
-            return value
+            return _result(value)
 
         def get_cache_key(*args, **kwargs):
             """ Returns name of cache key utilized """
             full_name(*args)
-            key = _get_key(wrapper._full_name, 'function', args, kwargs)
-            return key
+            key = _get_function_key(wrapper._full_name, args, kwargs)
+            return registry.make_key(key, model_list, tags=_tags(args, kwargs, bound=False))
+
+        def get_many(calls, loader=None):
+            """
+            Returns results for a sequence of ``(args, kwargs)`` pairs, in
+            order, as if the function was called for each of them.
+
+            All keys are fetched with one ``get_many`` call and the missing
+            values are stored with one ``set_many`` call. Misses are computed
+            by calling the function for each of them or, if ``loader`` is
+            passed, by a single ``loader(misses)`` call which receives the
+            list of missing ``(args, kwargs)`` pairs and must return their
+            results in the same order.
+            """
+            calls = [(tuple(args), dict(kwargs)) for args, kwargs in calls]
+            if not calls:
+                return []
+            full_name(*calls[0][0])
+
+            keys = [_get_key(wrapper._full_name, args, kwargs) for args, kwargs in calls]
+            calls_by_key = dict(zip(keys, calls))
+            tags_by_key = dict((key, _tags(*call)) for key, call in calls_by_key.items())
+            unique_keys = list(calls_by_key)
+            values = {}
+            for key in unique_keys:
+                value = _local_get(key)
+                if value is not None:
+                    values[key] = value
+            remote_keys = [key for key in unique_keys if key not in values]
+            if remote_keys:
+                # tokens of all models and tags are fetched at once
+                all_tags = set(tag for key in remote_keys for tag in tags_by_key[key])
+                versions = registry.get_versions(model_list, all_tags)
+                remote_keys = dict(
+                    (registry.make_key(key, model_list, versions, tags_by_key[key]), key) for key in remote_keys
+                )
+                started = metrics.clock()
+                remote_values = cache_backend.get_many(list(remote_keys), **backend_kwargs)
+                # chunks of all chunked values are fetched at once
+                chunk_keys = [chunk_key for value in remote_values.values() for chunk_key in _chunk_keys(value)]
+                chunk_values = cache_backend.get_many(chunk_keys, **backend_kwargs) if chunk_keys else None
+                metrics.record_time(wrapper._full_name, 'get_time', started)
+                for remote_key, key in remote_keys.items():
+                    value = _load(remote_values.get(remote_key), chunk_values)
+                    value = _unwrap(remote_key, key, value, *calls_by_key[key])
+                    if value is None:
+                        _miss()
+                    else:
+                        _hit()
+                        values[key] = value
+                        _local_set(key, value)
+
+            misses = {}
+            for key, call in zip(keys, calls):
+                if key not in values and key not in misses:
+                    misses[key] = call
+
+            if misses:
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Cache MISS: %s", ", ".join(misses))
+                if loader is None:
+                    results = [_call(args, kwargs) for args, kwargs in misses.values()]
+                else:
+                    started = metrics.clock()
+                    results = list(loader(list(misses.values())))
+                    metrics.record_time(wrapper._full_name, 'compute_time', started)
+                    if len(results) != len(misses):
+                        raise ValueError(
+                            "loader returned %d results for %d calls" % (len(results), len(misses))
+                        )
+                computed = dict(zip(misses, results))
+                values.update(computed)
+                to_set = dict(
+                    (key, value) for key, value in computed.items()
+                    if value is not None or negative_timeout is not None
+                )
+                if to_set:
+                    _store_many(dict(
+                        (registry.make_key(key, model_list, versions, tags_by_key[key]), value)
+                        for key, value in to_set.items()
+                    ))
+                    for key, value in to_set.items():
+                        _local_set(key, _pack(value)[0])
+
+            return [_result(values[key]) for key in keys]
+
+        def _map(*iterables):
+            """
+            Like the builtin ``map``: returns results for positional arguments
+            taken from ``iterables``, looked up in bulk via ``get_many``.
+            """
+            return get_many((args, {}) for args in zip(*iterables))
+
+        def _backend_keys(calls):
+            """ Returns (key, backend key) pairs for ``(args, kwargs)`` pairs.
+                Model and tag tokens of all calls are fetched at once.
+            """
+            keys = [_get_key(wrapper._full_name, args, kwargs) for args, kwargs in calls]
+            call_tags = [_tags(args, kwargs) for args, kwargs in calls]
+            versions = registry.get_versions(model_list, set(tag for key_tags in call_tags for tag in key_tags))
+            return [
+                (key, registry.make_key(key, model_list, versions, key_tags)) for key, key_tags in zip(keys, call_tags)
+            ]
+
+        def missing(calls):
+            """
+            Returns the ``(args, kwargs)`` pairs whose results are not in the
+            cache backend, checked with one ``get_many`` call.
+            """
+            calls = [(tuple(args), dict(kwargs)) for args, kwargs in calls]
+            if not calls:
+                return []
+            full_name(*calls[0][0])
+            backend_keys = [backend_key for key, backend_key in _backend_keys(calls)]
+            found = cache_backend.get_many(backend_keys, **backend_kwargs)
+            return [call for call, backend_key in zip(calls, backend_keys) if backend_key not in found]
+
+        def store_many(calls, results):
+            """
+            Stores results computed for ``(args, kwargs)`` pairs with one
+            ``set_many`` call, as ``force_recalc`` does for a single call.
+            """
+            calls = [(tuple(args), dict(kwargs)) for args, kwargs in calls]
+            if not calls:
+                return
+            full_name(*calls[0][0])
+            data, local_values = {}, {}
+            for (key, backend_key), value in zip(_backend_keys(calls), results):
+                if value is None and negative_timeout is None:
+                    continue
+                data[backend_key] = value
+                local_values[key] = value
+            if data:
+                _store_many(data)
+            for key, value in local_values.items():
+                _local_set(key, _pack(value)[0])
+
+        def cache_info():
+            """ Returns hit/miss counters for the local and backend tiers """
+            info = {'backend': backend_stats.as_dict()}
+            if local_cache is not None:
+                info['local'] = local_cache.stats.as_dict()
+            if tracker is not None:
+                info['adaptive'] = tracker.as_dict()
+            return info
+
+        def stats():
+            """ Returns metrics of the function collected by `metrics.memory`,
+                see `cache_utils.metrics`.
+            """
+            if not hasattr(wrapper, '_full_name'):
+                return {}
+            return metrics.memory.stats(wrapper._full_name)
 
         wrapper.require_cache = require_cache
         wrapper.invalidate = invalidate
-        wrapper.force_recalc = force_recalc
         wrapper.get_cache_key = get_cache_key
+        wrapper.cache_info = cache_info
+        wrapper.stats = stats
+        if is_async:
+            wrapper.ainvalidate = ainvalidate
+            wrapper.aforce_recalc = aforce_recalc
+            wrapper.arequire_cache = arequire_cache
+            wrapper.aget_cache_key = aget_cache_key
+        else:
+            wrapper.force_recalc = force_recalc
+            wrapper.get_many = get_many
+            wrapper.map = _map
+            wrapper.missing = missing
+            wrapper.store_many = store_many
+            if sync_to_async is not None:
+                wrapper.ainvalidate = sync_to_async(invalidate, thread_sensitive=True)
+                wrapper.aforce_recalc = sync_to_async(force_recalc, thread_sensitive=True)
+                wrapper.arequire_cache = sync_to_async(require_cache, thread_sensitive=True)
+                wrapper.aget_cache_key = sync_to_async(get_cache_key, thread_sensitive=True)
+        if func_type == 'function':
+            full_name()
         return wrapper
     return _cached
 
@@ -151,11 +1043,39 @@ def cached(timeout, group=None, backend='default', key=None, model_list=[], hash
 class NoCachedValueException(Exception):
     pass
 
-def invalidate_model(sender, instance, *args, **kwargs):
-    cache_backend = caches['default']
-    keys = registry.retrieve_keys(sender)
-    if keys:
-        for key in keys:
-            cache_backend.delete(key)
+def invalidate_model(sender, instance=None, *args, **kwargs):
+    """ Invalidates results of functions cached with `sender` in `model_list`.
+        Connected to `post_save` and `post_delete` of registered models.
+    """
+    registry.invalidate(sender)
 
-models.signals.post_save.connect(invalidate_model)
+
+def defer_invalidation(on_commit=False, using=None):
+    """ Context manager which collects model invalidations made in the block
+        and applies each of them once when the block exits, or when the
+        transaction commits if `on_commit` is True::
+
+            with defer_invalidation():
+                for row in rows:
+                    Product.objects.create(**row)  # no cache calls here
+    """
+    return registry.defer(on_commit=on_commit, using=using)
+
+
+def invalidate_tags(tags):
+    """ Invalidates results of cached functions which have any of tags.
+        Costs one `delete_many` of the tag tokens however many keys have
+        them.
+    """
+    registry.invalidate_tags(tags)
+
+
+def bulk_update(model, objs, fields, **kwargs):
+    """ `bulk_update` of model's default manager followed by invalidation
+        of the model and of the updated instances: django sends no signals
+        for bulk updates.
+    """
+    result = model._default_manager.bulk_update(objs, fields, **kwargs)
+    invalidate_model(model)
+    instances.invalidate_instances(model, [obj.pk for obj in objs])
+    return result
@@ -5,16 +5,28 @@ gracefull updates and multiple django projects on same memcached instance.
 Long keys (>250) are truncated and appended with md5 hash.
 """
 
+import os
+import struct
+import threading
 import time
 import uuid
 
 from django.conf import settings
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
 try:
     from django.core.cache.backends.memcached import PyMemcacheCache
 except ImportError:  # Django < 3.2
     from django.core.cache.backends.memcached import MemcachedCache as PyMemcacheCache
 from django.utils.encoding import smart_str
+from django.utils.functional import cached_property
+from django.utils.module_loading import import_string
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
 
+from cache_utils import chunks, local, memo
+from cache_utils.serializers import DEFAULT_COMPRESS_THRESHOLD, Codec
 from cache_utils.utils import sanitize_memcached_key
 
 
@@ -26,51 +38,390 @@ _KEY_PREFIX = "_group::"
 # be generated (in seconds)
 MINT_DELAY = 30
 
+# pymemcache flag of values stored by MintCacheSerde
+FLAG_MINTCACHE = 1 << 8
+
+# Group hashkeys known to this process by (servers, group key), as
+# (hashkey, expiry) pairs. Reads verify them in the same multi-get as the
+# data, writes trust them for up to GROUP_HASHKEY_TTL seconds.
+_hashkeys = {}
+
+# Pooled clients shared by the threads of a process, by (pid, servers,
+# OPTIONS), so forked workers create their own.
+_clients = {}
+_clients_lock = threading.Lock()
+
+# first-class OPTIONS and the pymemcache HashClient arguments they set
+_CLIENT_OPTIONS = {
+    'CONNECT_TIMEOUT': 'connect_timeout',
+    'TIMEOUT': 'timeout',
+    'NO_DELAY': 'no_delay',
+    'POOL_SIZE': 'max_pool_size',
+    'POOL_IDLE_TIMEOUT': 'pool_idle_timeout',
+    'RETRY_ATTEMPTS': 'retry_attempts',
+    'RETRY_TIMEOUT': 'retry_timeout',
+    'DEAD_TIMEOUT': 'dead_timeout',
+    'HASHER': 'hasher',
+}
+
+
+class MintCacheSerde(object):
+    """ pymemcache serde which stores MintCache tuples as a fixed size header
+        (refresh time and refreshed flag) followed by the value dumped with
+        a Codec, instead of pickling the whole tuple. Without a codec tuple
+        values must be bytes already and are stored as they are. Other
+        values, like group hashkeys, are handled by the `fallback` serde.
+    """
+    _header = struct.Struct('<d?')
+
+    def __init__(self, codec, fallback):
+        self.codec = codec
+        self.fallback = fallback
+
+    def serialize(self, key, value):
+        if type(value) is tuple and len(value) == 3:
+            value, refresh_time, refreshed = value
+            if self.codec is not None:
+                value = self.codec.dumps(value)
+            return self._header.pack(refresh_time, refreshed) + value, FLAG_MINTCACHE
+        return self.fallback.serialize(key, value)
+
+    def deserialize(self, key, value, flags):
+        if flags == FLAG_MINTCACHE:
+            refresh_time, refreshed = self._header.unpack_from(value)
+            value = value[self._header.size:]
+            if self.codec is not None:
+                value = self.codec.loads(value)
+            return value, refresh_time, refreshed
+        return self.fallback.deserialize(key, value, flags)
+
 
 class CacheClass(PyMemcacheCache):
+    """ Accepts these OPTIONS besides the pymemcache client ones:
+
+        SERIALIZER: 'pickle', 'json' or 'msgpack'. Values are stored in a
+            compact binary format instead of a pickled MintCache tuple.
+        COMPRESSOR: 'zlib' (default), 'lz4' or None.
+        COMPRESS_THRESHOLD: values serialized to at least this many bytes
+            are compressed, 1024 by default.
+        GROUP_HASHKEY_TTL: for how many seconds group hashkeys are kept in
+            process, 5 by default, 0 to disable. A grouped read then takes a
+            single round trip: the hashkey is verified in the same
+            multi-get as the data. Writes may use a hashkey replaced by
+            another process for up to this long, such values are never read.
+        CHUNK_SIZE: values serialized to more than this many bytes (e.g.
+            `chunks.DEFAULT_CHUNK_SIZE`) are split into chunks to fit the
+            memcached item size limit. All values are then serialized by
+            the backend, with pickle unless SERIALIZER is set.
+
+        With pymemcache these tune its HashClient:
+
+        POOL: keep a thread-safe pool of connections per server, shared
+            by all threads of the process and kept open between requests.
+            Without it every thread has its own client, disconnected at the
+            end of every request.
+        POOL_SIZE: the most connections the pool opens per server. Calls
+            made when all of them are in use fail, so this must not be
+            less than the number of threads; unlimited by default.
+        POOL_IDLE_TIMEOUT: seconds after which idle pooled connections are
+            closed, 0 (never) by default.
+        CONNECT_TIMEOUT, TIMEOUT: socket timeouts in seconds.
+        NO_DELAY: set TCP_NODELAY, True by default.
+        RETRY_ATTEMPTS, RETRY_TIMEOUT: how many times and how often a
+            failing server is retried before it is marked dead.
+        DEAD_TIMEOUT: seconds a dead server is left out for.
+        HASHER: class (or its dotted path) mapping keys to servers. The
+            default rendezvous hashing only remaps keys of the added or
+            removed server when the server list changes.
+    """
+
+    # `add` can store values raw, see `locks.Lease`
+    supports_raw = True
+
+    def __init__(self, server, params):
+        params = dict(params)
+        options = dict(params.get('OPTIONS') or {})
+        # backends configured alike share a pooled client
+        self._pool_key = repr(sorted(options.items())) if options.get('POOL') else None
+        serializer = options.pop('SERIALIZER', None)
+        compressor = options.pop('COMPRESSOR', 'zlib')
+        compress_threshold = options.pop('COMPRESS_THRESHOLD', DEFAULT_COMPRESS_THRESHOLD)
+        self._chunk_size = options.pop('CHUNK_SIZE', None)
+        self._hashkey_ttl = options.pop('GROUP_HASHKEY_TTL', 5)
+        options.pop('POOL', None)
+        client_options = dict((name, options.pop(option)) for option, name in _CLIENT_OPTIONS.items()
+                              if option in options)
+        params['OPTIONS'] = options
+        super(CacheClass, self).__init__(server, params)
+
+        if self._options.get('serde') is not None:
+            client_options.setdefault('no_delay', True)
+            if isinstance(client_options.get('hasher'), str):
+                client_options['hasher'] = import_string(client_options['hasher'])
+            if self._pool_key is not None:
+                client_options['use_pooling'] = True
+            for name, value in client_options.items():
+                # pymemcache arguments given in OPTIONS take precedence
+                self._options.setdefault(name, value)
+        else:
+            self._pool_key = None
+
+        self._codec = None
+        if self._chunk_size:
+            self._codec = Codec(serializer or 'pickle', compressor, compress_threshold)
+        # custom serdes are supported by pymemcache only
+        if (serializer or self._codec) and self._options.get('serde') is not None:
+            # values are already serialized by the backend if it chunks them
+            codec = None if self._codec else Codec(serializer, compressor, compress_threshold)
+            self._options['serde'] = MintCacheSerde(codec, self._options['serde'])
+
+    @cached_property
+    def _cache(self):
+        if self._pool_key is None:
+            # pooling is set up on the pymemcache path (Django >= 3.2) only
+            return super(CacheClass, self)._cache
+        key = (os.getpid(), tuple(self._servers), self._pool_key)
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = self._class(self.client_servers, **self._options)
+        return client
+
+    def close(self, **kwargs):
+        # pooled connections are reused by the next requests
+        if self._pool_key is None:
+            super(CacheClass, self).close(**kwargs)
 
     def _get_real_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            return self.default_timeout
         return timeout or self.default_timeout
 
-    def add(self, key, value, timeout=0, group=None):
-        key = self._make_key(group, key)
-
+    def _pack(self, value, timeout, refreshed=False):
+        """ Wraps value into a MintCache tuple. Returns the packed value and
+            the real timeout it should be stored with.
+        """
         timeout = self._get_real_timeout(timeout)
         refresh_time = timeout + time.time()
         real_timeout = timeout + MINT_DELAY
-        packed_value = (value, refresh_time, False)
+        return (value, refresh_time, refreshed), real_timeout
+
+    def _unpack(self, packed_value):
+        """ Returns (value, is_stale) for a MintCache tuple. """
+        value, refresh_time, refreshed = packed_value
+        return value, (time.time() > refresh_time) and not refreshed
+
+    def _encode(self, value):
+        """ Serializes value if the backend chunks values. Returns the value
+            to store in the MintCache tuple (the data or the manifest of its
+            chunks) and a dict of chunks to store along with it.
+        """
+        if self._codec is None:
+            return value, {}
+        data = self._codec.dumps(value)
+        if len(data) <= self._chunk_size:
+            return data, {}
+        manifest, chunk_values = chunks.split(data, self._chunk_size)
+        return manifest, dict((self._make_key(None, key), chunk) for key, chunk in chunk_values.items())
+
+    def _chunk_keys(self, value):
+        if self._codec is None or not chunks.is_manifest(value):
+            return []
+        return [self._make_key(None, key) for key in chunks.chunk_keys(value)]
 
+    def _decode(self, value, chunk_values):
+        """ Inverse of `_encode`, returns None if chunks are missing """
+        if self._codec is None:
+            return value
+        if chunks.is_manifest(value):
+            value = chunks.join(value, [chunk_values.get(key) for key in self._chunk_keys(value)])
+            if value is None:
+                return None
+        return self._codec.loads(value)
+
+    def add(self, key, value, timeout=0, group=None, raw=False):
+        """ With `raw` the value is stored as it is, like counters: it
+            expires after exactly `timeout` seconds and is never served
+            stale, as leases of `locks.Lease` must be.
+        """
+        key = self._make_key(group, key)
+        if raw:
+            return super(CacheClass, self).add(key, value, self._get_real_timeout(timeout))
+        value, chunk_values = self._encode(value)
+        packed_value, real_timeout = self._pack(value, timeout)
+        if chunk_values:
+            # chunks stored by a failed add expire unused
+            super(CacheClass, self).set_many(chunk_values, real_timeout)
         return super(CacheClass, self).add(key, packed_value, real_timeout)
 
+    def _get_packed(self, keys, group):
+        """ Fetches MintCache tuples of keys, returns them by real key and a
+            dict of keys by real key. A group hashkey kept in process is
+            checked in the same multi-get; if it has been replaced the keys
+            are fetched again with the current one.
+        """
+        if not group:
+            key_map = dict((self._make_key(None, key), key) for key in keys)
+            return super(CacheClass, self).get_many(list(key_map)), key_map
+
+        group_key = self._group_key(group)
+        known_hashkey = self._known_hashkey(group)
+        hashkey = known_hashkey or self._get_hashkey(group)
+        key_map = dict((self._make_key(group, key, hashkey), key) for key in keys)
+        if known_hashkey is None:
+            return super(CacheClass, self).get_many(list(key_map)), key_map
+
+        packed_values = super(CacheClass, self).get_many(list(key_map) + [group_key])
+        current_hashkey = packed_values.pop(group_key, None)
+        if current_hashkey is None:
+            # the group key was deleted (or evicted), which invalidates it
+            current_hashkey = self._add_hashkey(group, str(uuid.uuid4()))
+        if current_hashkey != hashkey:
+            self._remember_hashkey(group, current_hashkey)
+            key_map = dict((self._make_key(group, key, current_hashkey), key) for key in keys)
+            packed_values = super(CacheClass, self).get_many(list(key_map))
+        return packed_values, key_map
+
     def get(self, key, version=None, default=None, group=None):
-        key = self._make_key(group, key)
-        packed_value = super(CacheClass, self).get(key, default)
+        packed_values, key_map = self._get_packed([key], group)
+        key = next(iter(key_map))
+        packed_value = packed_values.get(key)
         if packed_value is None:
             return default
-        value, refresh_time, refreshed = packed_value
-        if (time.time() > refresh_time) and not refreshed:
+        if type(packed_value) is not tuple:
+            # counters are stored raw
+            return packed_value
+        value, stale = self._unpack(packed_value)
+        if stale:
             # Store the stale value while the cache revalidates for another
             # MINT_DELAY seconds.
-            self.set(key, value, timeout=MINT_DELAY, group=group, refreshed=True)
+            packed_value, real_timeout = self._pack(value, MINT_DELAY, refreshed=True)
+            super(CacheClass, self).set(key, packed_value, real_timeout)
             return default
-        return value
+        chunk_keys = self._chunk_keys(value)
+        value = self._decode(value, super(CacheClass, self).get_many(chunk_keys) if chunk_keys else {})
+        return default if value is None else value
 
     def set(self, key, value, timeout=0, group=None, refreshed=False):
         key = self._make_key(group, key)
-        timeout = self._get_real_timeout(timeout)
-        refresh_time = timeout + time.time()
-        real_timeout = timeout + MINT_DELAY
-        packed_value = (value, refresh_time, refreshed)
+        value, chunk_values = self._encode(value)
+        packed_value, real_timeout = self._pack(value, timeout, refreshed)
+        if chunk_values:
+            # a manifest whose chunks failed to be stored is read as a miss
+            chunk_values[key] = packed_value
+            super(CacheClass, self).set_many(chunk_values, real_timeout)
+            return
         return super(CacheClass, self).set(key, packed_value, real_timeout)
 
     def delete(self, key, group=None):
-        key = self._make_key(group, key)
+        # deletes must not miss the current key, so the hashkey is fetched
+        hashkey = self._get_hashkey(group, fresh=True) if group else None
+        key = self._make_key(group, key, hashkey)
         return super(CacheClass, self).delete(key)
 
+    def get_many(self, keys, version=None, group=None):
+        """ Fetches keys with a single multi-get, which also verifies the
+            group hashkey if it is kept in process. Stale values are
+            treated as missing and are revalidated with a single multi-set,
+            same as in `get`.
+        """
+        packed_values, key_map = self._get_packed(keys, group)
+
+        values, stale_values, chunk_keys, counters = {}, {}, [], {}
+        for real_key, packed_value in packed_values.items():
+            if type(packed_value) is not tuple:
+                # counters are stored raw
+                counters[key_map[real_key]] = packed_value
+                continue
+            value, stale = self._unpack(packed_value)
+            if stale:
+                stale_values[real_key], real_timeout = self._pack(value, MINT_DELAY, refreshed=True)
+            else:
+                values[key_map[real_key]] = value
+                chunk_keys.extend(self._chunk_keys(value))
+        if stale_values:
+            super(CacheClass, self).set_many(stale_values, real_timeout)
+        if self._codec is not None:
+            # chunks of all chunked values are fetched at once
+            chunk_values = super(CacheClass, self).get_many(chunk_keys) if chunk_keys else {}
+            for key, value in list(values.items()):
+                value = self._decode(value, chunk_values)
+                if value is None:
+                    del values[key]
+                else:
+                    values[key] = value
+        values.update(counters)
+        return values
+
+    def set_many(self, data, timeout=0, group=None):
+        """ Stores data with a single multi-set. Group hashkey is looked up
+            once per call. Returns a list of keys that failed to be stored.
+        """
+        hashkey = self._get_hashkey(group) if group else None
+        key_map, packed_values = {}, {}
+        for key, value in data.items():
+            real_key = self._make_key(group, key, hashkey)
+            key_map[real_key] = key
+            value, chunk_values = self._encode(value)
+            packed_values.update(chunk_values)
+            packed_values[real_key], real_timeout = self._pack(value, timeout)
+        if not packed_values:
+            return []
+        failed_keys = super(CacheClass, self).set_many(packed_values, real_timeout)
+        return [key_map[key] for key in failed_keys if key in key_map]
+
+    def delete_many(self, keys, group=None):
+        hashkey = self._get_hashkey(group, fresh=True) if group else None
+        keys = [self._make_key(group, key, hashkey) for key in keys]
+        if keys:
+            super(CacheClass, self).delete_many(keys)
+
+    # Django's async methods call the sync ones without `group`, so they are
+    # overridden to pass it through.
+
+    async def aadd(self, key, value, timeout=0, group=None):
+        return await sync_to_async(self.add, thread_sensitive=True)(key, value, timeout, group=group)
+
+    async def aget(self, key, version=None, default=None, group=None):
+        return await sync_to_async(self.get, thread_sensitive=True)(key, version, default, group=group)
+
+    async def aset(self, key, value, timeout=0, group=None, refreshed=False):
+        return await sync_to_async(self.set, thread_sensitive=True)(key, value, timeout, group=group,
+                                                                     refreshed=refreshed)
+
+    async def adelete(self, key, group=None):
+        return await sync_to_async(self.delete, thread_sensitive=True)(key, group=group)
+
+    async def aget_many(self, keys, version=None, group=None):
+        return await sync_to_async(self.get_many, thread_sensitive=True)(keys, version, group=group)
+
+    async def aset_many(self, data, timeout=0, group=None):
+        return await sync_to_async(self.set_many, thread_sensitive=True)(data, timeout, group=group)
+
+    async def adelete_many(self, keys, group=None):
+        return await sync_to_async(self.delete_many, thread_sensitive=True)(keys, group=group)
+
+    async def aincr(self, key, delta=1, version=None, group=None, initial=None, timeout=0):
+        return await sync_to_async(self.incr, thread_sensitive=True)(key, delta, version, group=group,
+                                                                      initial=initial, timeout=timeout)
+
+    async def adecr(self, key, delta=1, version=None, group=None, initial=None, timeout=0):
+        return await sync_to_async(self.decr, thread_sensitive=True)(key, delta, version, group=group,
+                                                                      initial=initial, timeout=timeout)
+
+    async def aincr_many(self, deltas, group=None, initial=None, timeout=0, noreply=False):
+        return await sync_to_async(self.incr_many, thread_sensitive=True)(deltas, group=group, initial=initial,
+                                                                           timeout=timeout, noreply=noreply)
+
     def invalidate_group(self, group):
-        """ Invalidates all cache keys belonging to group """
-        key = "%s%s%s" % (_VERSION_PREFIX, _KEY_PREFIX, group)
-        super(CacheClass, self).delete(key)
+        """ Invalidates all cache keys belonging to group by replacing its
+            hashkey.
+        """
+        hashkey = str(uuid.uuid4())
+        super(CacheClass, self).set(self._group_key(group), hashkey)
+        self._remember_hashkey(group, hashkey)
+        local.invalidate_group(group)
+        memo.clear()
 
     def _make_key(self, group, key, hashkey=None):
         """ Generates a new cache key which belongs to a group, has
@@ -94,38 +445,100 @@ class CacheClass(PyMemcacheCache):
         """
         return smart_str(key)
 
-    def _get_hashkey(self, group):
+    def _group_key(self, group):
+        return "%s%s%s" % (_VERSION_PREFIX, _KEY_PREFIX, group)
+
+    def _known_hashkey(self, group):
+        """ Returns the hashkey of group kept in process or None """
+        item = _hashkeys.get((tuple(self._servers), self._group_key(group)))
+        if item is not None and item[1] > time.monotonic():
+            return item[0]
+        return None
+
+    def _remember_hashkey(self, group, hashkey):
+        if self._hashkey_ttl:
+            _hashkeys[(tuple(self._servers), self._group_key(group))] = (hashkey, time.monotonic() + self._hashkey_ttl)
+
+    def _add_hashkey(self, group, hashkey):
+        """ Stores hashkey of group unless another process has just done
+            it. Returns the current hashkey.
+        """
+        key = self._group_key(group)
+        if super(CacheClass, self).add(key, hashkey):
+            return hashkey
+        return super(CacheClass, self).get(key) or hashkey
+
+    def _get_hashkey(self, group, fresh=False):
         """ This can be useful sometimes if you're doing a very large number
             of operations and you want to avoid all of the extra cache hits.
+            The hashkey kept in process is returned unless `fresh` is set.
         """
-        key = "%s%s%s" % (_VERSION_PREFIX, _KEY_PREFIX, group)
-        hashkey = super(CacheClass, self).get(key)
+        hashkey = None if fresh else self._known_hashkey(group)
         if hashkey is None:
-            hashkey = str(uuid.uuid4())
-            super(CacheClass, self).set(key, hashkey)
+            hashkey = super(CacheClass, self).get(self._group_key(group))
+            if hashkey is None:
+                hashkey = self._add_hashkey(group, str(uuid.uuid4()))
+            self._remember_hashkey(group, hashkey)
         return hashkey
 
     def clear(self):
-        self._cache.flush_all()
-
-# ======================================
-# I didn't implement methods below to work with MintCache so raise
-# NotImplementedError for them.
-
-    def incr(self, key, delta=1, group=None):
-        # if group:
-        #     key = self._make_key(group, key)
-        # return super(CacheClass, self).incr(key, delta)
-        raise NotImplementedError
-
-    def decr(self, key, delta=1, group=None):
-        # if group:
-        #     key = self._make_key(group, key)
-        # return super(CacheClass, self).decr(key, delta)
-        raise NotImplementedError
-
-    def get_many(self, keys, group=None):
-        # hashkey = self._get_hashkey(group)
-        # keys = [self._make_key(group, k, hashkey) for k in keys]
-        # return super(CacheClass, self).get_many(keys)
-        raise NotImplementedError
+        """ Flushes every server, not only the one a single client is
+            connected to, and forgets group hashkeys kept in process.
+        """
+        clients = getattr(self._cache, 'clients', None)
+        for client in (clients.values() if clients else [self._cache]):
+            client.flush_all()
+        for key in [key for key in _hashkeys if key[0] == tuple(self._servers)]:
+            _hashkeys.pop(key, None)
+        memo.clear()
+
+    # Counters are stored raw, not in a MintCache tuple, so memcached
+    # increments them atomically. They can be read with `get`/`get_many`.
+
+    def _incr(self, key, delta, initial, timeout):
+        try:
+            return super(CacheClass, self).incr(key, delta)
+        except ValueError:
+            if initial is None:
+                raise
+        # memcached counters can't go below zero
+        value = max(initial + delta, 0)
+        if super(CacheClass, self).add(key, value, self._get_real_timeout(timeout)):
+            return value
+        # another process has just created the counter
+        return super(CacheClass, self).incr(key, delta)
+
+    def incr(self, key, delta=1, version=None, group=None, initial=None, timeout=0):
+        """ Adds delta to a counter and returns the new value. A missing
+            counter raises ValueError, or is created with `initial + delta`
+            for `timeout` seconds if `initial` is given.
+        """
+        return self._incr(self._make_key(group, key), delta, initial, timeout)
+
+    def decr(self, key, delta=1, version=None, group=None, initial=None, timeout=0):
+        return self.incr(key, -delta, version, group=group, initial=initial, timeout=timeout)
+
+    def incr_many(self, deltas, group=None, initial=None, timeout=0, noreply=False):
+        """ Adds deltas to counters given as a dict, returns a dict of new
+            values without the counters which are missing (unless `initial`
+            is given). Group hashkey is looked up once per call, but the
+            counters are still incremented one round trip at a time; only
+            with `noreply` the increments are sent without waiting for
+            replies: nothing is returned and missing counters are not
+            created.
+        """
+        hashkey = self._get_hashkey(group) if group else None
+        values = {}
+        for key, delta in deltas.items():
+            real_key = self._make_key(group, key, hashkey)
+            if noreply:
+                if delta < 0:
+                    self._cache.decr(real_key, -delta, noreply=True)
+                else:
+                    self._cache.incr(real_key, delta, noreply=True)
+                continue
+            try:
+                values[key] = self._incr(real_key, delta, initial, timeout)
+            except ValueError:
+                pass
+        return None if noreply else values
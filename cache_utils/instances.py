@@ -0,0 +1,137 @@
+"""
+Object-level cache of model instances. `cached_instances` caches the
+result of a query as a list of primary keys and every instance once, under
+its `(model, pk)` key, however many cached queries return it. Saving or
+deleting an instance invalidates its key only; lists of primary keys are
+invalidated as `cached` results with `model_list` are.
+"""
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import models, transaction
+from django.utils.functional import wraps
+
+from cache_utils import decorators
+from cache_utils.utils import sanitize_memcached_key
+
+
+_INSTANCE_PREFIX = "_instance::"
+
+# cache aliases instances of every model are stored in
+_backends = {}
+
+
+def _instance_key(model, pk):
+    return sanitize_memcached_key("%s%s:%s" % (_INSTANCE_PREFIX, model._meta.label_lower, pk))
+
+
+def register_model(model, backend='default'):
+    """ Makes saves and deletes of model's instances invalidate their keys
+        in the `backend` cache.
+    """
+    model = model._meta.concrete_model
+    if model not in _backends:
+        _backends[model] = set()
+        models.signals.post_save.connect(invalidate_instance, sender=model)
+        models.signals.post_delete.connect(invalidate_instance, sender=model)
+    _backends[model].add(backend)
+
+
+def instance_keys(instance_pks):
+    """ Returns keys of instances given as {model: pks} by cache alias """
+    keys = {}
+    for model, pks in instance_pks.items():
+        model = model._meta.concrete_model
+        for backend in _backends.get(model, ()):
+            keys.setdefault(backend, []).extend(_instance_key(model, pk) for pk in pks)
+    return keys
+
+
+def invalidate_instances(model, pks, using=None):
+    """ Deletes cached instances of model with primary keys `pks`, or
+        records them if invalidation is deferred (see
+        `decorators.defer_invalidation`). Inside a transaction they are
+        deleted again when it commits, so concurrent readers can't cache
+        the rows as they were before it.
+    """
+    pks = list(pks)
+    if model._meta.concrete_model not in _backends or not pks:
+        return
+    if decorators.registry.defer_instances(model, pks):
+        return
+
+    def delete():
+        for backend, keys in instance_keys({model: pks}).items():
+            caches[backend].delete_many(keys)
+    delete()
+    if transaction.get_connection(using).in_atomic_block:
+        transaction.on_commit(delete, using=using)
+
+
+def invalidate_instance(sender, instance=None, using=None, **kwargs):
+    """ Connected to `post_save` and `post_delete` of registered models. """
+    invalidate_instances(sender, [instance.pk], using=using)
+
+
+def get_instances(model, pks, backend='default', timeout=DEFAULT_TIMEOUT):
+    """ Returns instances of model with primary keys `pks`, in that order
+        and without the ones which don't exist. Cached instances are
+        fetched with one `get_many`, the others with one `pk__in` query and
+        stored with one `set_many` for `timeout` seconds, the backend's
+        default timeout by default.
+    """
+    cache_backend = caches[backend]
+    keys = dict((pk, _instance_key(model, pk)) for pk in pks)
+    cached_values = cache_backend.get_many(list(keys.values())) if keys else {}
+    instances = dict((pk, cached_values[key]) for pk, key in keys.items() if key in cached_values)
+    missing = [pk for pk in keys if pk not in instances]
+    if missing:
+        fetched = model._default_manager.in_bulk(missing)
+        if fetched:
+            cache_backend.set_many(dict((keys[pk], obj) for pk, obj in fetched.items()), timeout)
+        instances.update(fetched)
+    return [instances[pk] for pk in pks if pk in instances]
+
+
+def cached_instances(model, timeout, instance_timeout=None, backend='default', model_list=None, **kwargs):
+    """ Caches the model instances returned by a function (e.g. a queryset)
+        as a list of primary keys, and the instances themselves once per
+        `(model, pk)` for `instance_timeout` seconds (`timeout` by default)::
+
+            @cached_instances(Product, 60*60)
+            def cheap_products(max_price):
+                return Product.objects.filter(price__lt=max_price)
+
+        Lists of primary keys are cached with `cached`, which gets the
+        other keyword arguments. They depend on `model_list`, `[model]` by
+        default, so a save of any instance invalidates the lists, which
+        are cheap to rebuild, while only its own instance key is dropped.
+
+        For module level functions and static methods. The wrapper gets
+        `invalidate`, `get_cache_key` and `pks` (the cached list of
+        primary keys) of the same arguments.
+    """
+    if model_list is None:
+        model_list = [model]
+    if instance_timeout is None:
+        instance_timeout = timeout
+    register_model(model, backend)
+
+    def _cached_instances(func):
+        options = dict(kwargs)
+        # keys are named after func, not after the function below
+        options.setdefault('key', '%s.%s:%s' % (func.__module__, func.__qualname__, func.__code__.co_firstlineno))
+
+        @decorators.cached(timeout, backend=backend, model_list=model_list, **options)
+        def pks(*args, **kwargs):
+            return [obj.pk for obj in func(*args, **kwargs)]
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return get_instances(model, pks(*args, **kwargs), backend, instance_timeout)
+
+        wrapper.pks = pks
+        wrapper.invalidate = pks.invalidate
+        wrapper.get_cache_key = pks.get_cache_key
+        return wrapper
+    return _cached_instances
@@ -0,0 +1,105 @@
+"""
+Process-local cache tier used by the `cached` decorator in front of the
+django cache backend. Entries live for a short TTL only, so staleness
+across processes is bounded by it; invalidations made in this process are
+applied to the local tier immediately.
+"""
+
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+
+# all live LocalCache instances, used for process-wide invalidation
+_local_caches = weakref.WeakSet()
+
+
+class TierStats(object):
+    """ Hit/miss counters of a single cache tier. """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def miss(self):
+        with self._lock:
+            self.misses += 1
+
+    def as_dict(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+class LocalCache(object):
+    """ Thread-safe bounded LRU dict with a TTL for every entry. """
+
+    def __init__(self, ttl, maxsize=1000, group=None, model_list=(), tagged=False):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.group = group
+        self.model_list = tuple(model_list)
+        self.tagged = tagged
+        self.stats = TierStats()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        _local_caches.add(self)
+
+    def get(self, key):
+        """ Returns cached value or None, counting a hit or a miss. """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires = item
+                if expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.stats.hit()
+                    return value
+                del self._data[key]
+        self.stats.miss()
+        return None
+
+    def set(self, key, value):
+        if value is None:
+            return
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def invalidate_group(group):
+    """ Clears every local cache in this process which belongs to group. """
+    for local_cache in list(_local_caches):
+        if local_cache.group == group:
+            local_cache.clear()
+
+
+def invalidate_model(model):
+    """ Clears every local cache in this process which depends on model. """
+    for local_cache in list(_local_caches):
+        if model in local_cache.model_list:
+            local_cache.clear()
+
+
+def invalidate_tagged():
+    """ Clears every local cache in this process whose keys have tags. """
+    for local_cache in list(_local_caches):
+        if local_cache.tagged:
+            local_cache.clear()
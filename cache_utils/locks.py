@@ -0,0 +1,121 @@
+"""
+Dog-pile prevention for the `cached` decorator which works with any django
+cache backend: concurrent misses of the same key share one computation
+inside a process, and a short lease taken with `cache.add` lets only one
+process recompute while the others wait for its result.
+"""
+
+import asyncio
+import threading
+import time
+import uuid
+
+from cache_utils.utils import sanitize_memcached_key
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:  # Django < 3.0
+    sync_to_async = None
+
+
+_LOCK_PREFIX = "_lock::"
+
+# how often processes waiting for a lease holder check for its result
+LOCK_POLL_INTERVAL = 0.05
+
+
+def lock_key(key):
+    """ Returns the key of the lease guarding computation of key """
+    return sanitize_memcached_key(_LOCK_PREFIX + key)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """ Makes concurrent calls for the same key in this process share the
+        result of the first one.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class Lease(object):
+    """ Cross-process lease on computing a key, taken with `cache.add`.
+        It expires after `timeout` seconds if the holder dies. The group
+        backend stores it raw: in a MintCache tuple it would live
+        MINT_DELAY seconds longer while reading as missing.
+    """
+
+    def __init__(self, cache_backend, key, timeout):
+        self.cache_backend = cache_backend
+        self.key = lock_key(key)
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def acquire(self):
+        options = {'raw': True} if getattr(self.cache_backend, 'supports_raw', False) else {}
+        self.acquired = bool(self.cache_backend.add(self.key, self.token, self.timeout, **options))
+        return self.acquired
+
+    def release(self):
+        if self.acquired and self.cache_backend.get(self.key) == self.token:
+            self.cache_backend.delete(self.key)
+        self.acquired = False
+
+    def wait(self, get_value):
+        """ Polls `get_value` until it returns a value, the lease is
+            released or `timeout` passes. Returns the value or None.
+        """
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            value = get_value()
+            if value is not None:
+                return value
+            if self.cache_backend.get(self.key) is None:
+                return None
+        return None
+
+    async def async_wait(self, get_value):
+        """ Same as `wait` for async code, `get_value` is a coroutine function. """
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+            value = await get_value()
+            if value is not None:
+                return value
+            if await sync_to_async(self.cache_backend.get, thread_sensitive=True)(self.key) is None:
+                return None
+        return None
@@ -0,0 +1,83 @@
+"""
+Reports how effective cached functions are, using metrics collected by a
+`cache_utils.metrics.CacheSink` in all processes or, without one, by
+`cache_utils.metrics.memory` in this process only.
+"""
+
+from django.core.management.base import BaseCommand
+
+from cache_utils import metrics
+from cache_utils.decorators import registry
+
+
+def _total(stats, metric):
+    return stats.get(metric, {}).get('total', 0)
+
+
+def _count(stats, metric):
+    return stats.get(metric, {}).get('count', 0)
+
+
+def report_sink():
+    """ Returns the CacheSink in use, or the in-memory sink """
+    for sink in metrics.sinks():
+        if isinstance(sink, metrics.CacheSink):
+            return sink
+    return metrics.memory
+
+
+def function_report(sink=None):
+    """ Returns a list of effectiveness figures for every cached function
+        known to this process or to `sink` (`report_sink()` by default).
+    """
+    if sink is None:
+        sink = report_sink()
+    if isinstance(sink, metrics.CacheSink):
+        # records of this process are not buffered out of the report
+        sink.flush()
+    rows = []
+    for name in sorted(set(registry.functions) | set(sink.names())):
+        stats = sink.stats(name)
+        hits = _count(stats, 'hit') + _count(stats, 'local_hit')
+        calls = hits + _count(stats, 'miss')
+        computes = _count(stats, 'compute_time')
+        mean_compute_time = _total(stats, 'compute_time') / computes if computes else 0.0
+        keys, size = sink.keyspace(name)
+        rows.append({
+            'name': name,
+            'calls': calls,
+            'hit_rate': float(hits) / calls if calls else 0.0,
+            'mean_compute_time': mean_compute_time,
+            # time spent computing results which were served from cache
+            'saved': hits * mean_compute_time,
+            'keys': keys,
+            'bytes': size,
+        })
+    return rows
+
+
+class Command(BaseCommand):
+    help = "Lists cached functions with their hit rate, time saved and cache memory used."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=['saved', 'memory'], default='saved',
+                            help="Sort by time saved by caching or by bytes held in the cache.")
+        parser.add_argument('--limit', type=int, default=None, help="Show this many functions only.")
+
+    def handle(self, *args, **options):
+        sink = report_sink()
+        if sink not in metrics.sinks():
+            self.stderr.write("Neither cache_utils.metrics.CacheSink nor cache_utils.metrics.memory is in "
+                              "CACHE_UTILS_METRICS, only function names are known.")
+        elif sink is metrics.memory:
+            self.stderr.write("Metrics of this process only, add cache_utils.metrics.CacheSink to "
+                              "CACHE_UTILS_METRICS to report all processes.")
+        sort_key = 'saved' if options['sort'] == 'saved' else 'bytes'
+        rows = sorted(function_report(sink), key=lambda row: row[sort_key], reverse=True)[:options['limit']]
+
+        self.stdout.write("%-60s %10s %8s %12s %12s %8s %12s" % (
+            "function", "calls", "hit rate", "compute ms", "saved s", "keys", "bytes"))
+        for row in rows:
+            self.stdout.write("%-60s %10d %7.1f%% %12.2f %12.2f %8d %12d" % (
+                row['name'], row['calls'], row['hit_rate'] * 100, row['mean_compute_time'] * 1000,
+                row['saved'], row['keys'], row['bytes']))
@@ -0,0 +1,40 @@
+"""
+Pre-warms a cached function, see `cache_utils.warmup.warm`::
+
+    manage.py cache_utils_warm shop.utils.product_card shop.warmup.product_ids --only-missing
+"""
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from cache_utils.warmup import warm
+
+
+class Command(BaseCommand):
+    help = "Computes and stores results of a cached function for a stream of arguments."
+
+    def add_arguments(self, parser):
+        parser.add_argument('function', help="Dotted path to a function decorated with @cached.")
+        parser.add_argument('arguments', help="Dotted path to an iterable of arguments (tuples for several "
+                                              "arguments) or to a callable returning one, e.g. a generator.")
+        parser.add_argument('--only-missing', action='store_true', help="Skip arguments which are cached.")
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--processes', action='store_true', help="Compute in processes, not threads.")
+        parser.add_argument('--rate', type=float, default=None, help="Maximum keys written per second.")
+
+    def handle(self, *args, **options):
+        func = import_string(options['function'])
+        arguments = import_string(options['arguments'])
+        if callable(arguments):
+            arguments = arguments()
+
+        def progress(counters):
+            self.stdout.write("%(seen)d seen, %(skipped)d skipped, %(computed)d computed" % counters)
+
+        counters = warm(func, arguments, only_missing=options['only_missing'],
+                        batch_size=options['batch_size'], workers=options['workers'],
+                        processes=options['processes'], writes_per_second=options['rate'],
+                        progress=progress if options['verbosity'] > 1 else None)
+        self.stdout.write("Warmed %s: %d computed, %d skipped" % (
+            options['function'], counters['computed'], counters['skipped']))
@@ -0,0 +1,37 @@
+"""
+Request-scoped memo checked by the `cached` decorator before any cache tier.
+Results of cached functions are remembered for the duration of a request
+(see `middleware.RequestMemoMiddleware`) in a context variable, so it is
+isolated between threads and asyncio tasks of different requests.
+
+The memo of the current request is cleared by any model, tag or group
+invalidation made in it; `invalidate` and `force_recalc` update single
+entries.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+
+_memo = ContextVar('cache_utils_memo', default=None)
+
+
+def current():
+    """ Returns the memo dict of the current request or None """
+    return _memo.get()
+
+
+@contextmanager
+def request_memo():
+    """ Memoizes results of cached functions called in the block """
+    token = _memo.set({})
+    try:
+        yield
+    finally:
+        _memo.reset(token)
+
+
+def clear():
+    memo = _memo.get()
+    if memo is not None:
+        memo.clear()
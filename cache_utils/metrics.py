@@ -0,0 +1,301 @@
+"""
+Metrics of cached functions and `cache_utils.cache` calls.
+
+Every metric is recorded under a name (the cached function's full name, or
+`cache_utils.cache` for its functions) as a number: counters like `hit`, `miss`, `local_hit` and `stale` are recorded
+as 1, `compute_time`, `get_time` and `set_time` in seconds and `size` (of
+serialized values, if they are serialized by cache_utils) in bytes.
+
+Metrics go to sinks, objects with a `record(name, metric, value)` method.
+Nothing is measured while there are no sinks. Sinks are added with
+`add_sink` or listed as dotted paths to sink instances or classes in the
+CACHE_UTILS_METRICS setting::
+
+    CACHE_UTILS_METRICS = ['cache_utils.metrics.memory']
+
+`CacheSink` aggregates metrics of all processes in the cache, where the
+`cache_utils_report` command run in any process reads them.
+"""
+
+import atexit
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+
+# sent by SignalSink with `name`, `metric` and `value` arguments
+metric_recorded = Signal()
+
+_sinks = []
+
+# keys tracked per name by MemorySink, the oldest ones are dropped
+MAX_TRACKED_KEYS = getattr(settings, 'CACHE_UTILS_METRICS_MAX_KEYS', 10000)
+
+# checked before measuring anything
+enabled = False
+
+
+class MemorySink(object):
+    """ In-memory registry keeping count, total and max of every metric, and
+        the expiry time and size of keys stored in this process.
+    """
+
+    def __init__(self, max_keys=MAX_TRACKED_KEYS):
+        self.max_keys = max_keys
+        self._data = {}
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, metric, value):
+        with self._lock:
+            stat = self._data.setdefault(name, {}).get(metric)
+            if stat is None:
+                self._data[name][metric] = {'count': 1, 'total': value, 'max': value}
+            else:
+                stat['count'] += 1
+                stat['total'] += value
+                stat['max'] = max(stat['max'], value)
+
+    def record_key(self, name, key, size, timeout):
+        with self._lock:
+            keys = self._keys.setdefault(name, OrderedDict())
+            keys[key] = (time.time() + timeout if timeout else None, size)
+            keys.move_to_end(key)
+            if len(keys) > self.max_keys:
+                keys.popitem(last=False)
+
+    def forget_key(self, name, key):
+        with self._lock:
+            self._keys.get(name, {}).pop(key, None)
+
+    def keyspace(self, name):
+        """ Returns the number and total size of keys stored under name
+            which have not expired yet.
+        """
+        now = time.time()
+        with self._lock:
+            keys = self._keys.get(name, {})
+            for key, (expires, size) in list(keys.items()):
+                if expires is not None and expires < now:
+                    del keys[key]
+            return len(keys), sum(size for expires, size in keys.values())
+
+    def names(self):
+        with self._lock:
+            return sorted(set(self._data) | set(self._keys))
+
+    def stats(self, name):
+        """ Returns {metric: {'count': ..., 'total': ..., 'max': ...}} """
+        with self._lock:
+            return dict((metric, dict(stat)) for metric, stat in self._data.get(name, {}).items())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._keys.clear()
+
+
+class CallbackSink(object):
+    """ Calls `callback(name, value)` with dotted metric names like
+        ``prefix.module.func.hit``, e.g. for a statsd client.
+    """
+
+    def __init__(self, callback, prefix='cache_utils'):
+        self.callback = callback
+        self.prefix = prefix
+
+    def record(self, name, metric, value):
+        self.callback("%s.%s.%s" % (self.prefix, name, metric), value)
+
+
+class SignalSink(object):
+    """ Sends the `metric_recorded` signal. """
+
+    def record(self, name, metric, value):
+        metric_recorded.send(sender=None, name=name, metric=metric, value=value)
+
+
+class CacheSink(object):
+    """ Adds counts and totals of metrics of every process to counters of
+        the group backend (`incr_many`), and stores, bytes and timeouts of
+        stored keys from which `keyspace` estimates their footprint. Times
+        are counted in microseconds. Records are buffered and sent with one
+        `incr_many` every `flush_interval` seconds and at exit; counters
+        live for `timeout` seconds after the first record.
+
+            CACHE_UTILS_METRICS = ['cache_utils.metrics.CacheSink']
+    """
+
+    SCALES = {'compute_time': 1e6, 'get_time': 1e6, 'set_time': 1e6}
+
+    def __init__(self, backend='default', prefix='_metrics::', flush_interval=10, timeout=60 * 60 * 24 * 30):
+        self.backend = backend
+        self.prefix = prefix
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self._pending = {}
+        self._known = set()
+        self._flushed = time.time()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def _add(self, name, metric, value):
+        totals = self._pending.setdefault((name, metric), [0, 0])
+        totals[0] += 1
+        totals[1] += value
+
+    def record(self, name, metric, value):
+        with self._lock:
+            self._add(name, metric, value)
+        if time.time() - self._flushed >= self.flush_interval:
+            self.flush()
+
+    def record_key(self, name, key, size, timeout):
+        with self._lock:
+            self._add(name, 'stored_bytes', size)
+            if timeout:
+                self._add(name, 'stored_ttl', timeout)
+            else:
+                self._add(name, 'stored_forever', 1)
+
+    def _key(self, name, metric, field):
+        return '%s%s|%s|%s' % (self.prefix, name, metric, field)
+
+    def flush(self):
+        """ Sends buffered records, and names and metrics new to this
+            process to the index read by `names`.
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed = time.time()
+        if not pending:
+            return
+        cache = caches[self.backend]
+        deltas = {}
+        for (name, metric), (count, total) in pending.items():
+            deltas[self._key(name, metric, 'count')] = count
+            deltas[self._key(name, metric, 'total')] = int(round(total * self.SCALES.get(metric, 1)))
+        cache.incr_many(dict((key, delta) for key, delta in deltas.items() if delta), initial=0, timeout=self.timeout)
+        cache.add(self.prefix + 'since', time.time(), self.timeout)
+        if not self._known.issuperset(pending):
+            # racing processes may drop each other's names, they add them
+            # again on their next flush
+            index = cache.get(self.prefix + 'index') or {}
+            for name, metric in pending:
+                index.setdefault(name, [])
+                if metric not in index[name]:
+                    index[name].append(metric)
+            cache.set(self.prefix + 'index', index, self.timeout)
+            self._known.update(pending)
+
+    def names(self):
+        return sorted(caches[self.backend].get(self.prefix + 'index') or {})
+
+    def stats(self, name):
+        """ Returns {metric: {'count': ..., 'total': ...}} of all processes """
+        cache = caches[self.backend]
+        metrics = (cache.get(self.prefix + 'index') or {}).get(name, [])
+        keys = [self._key(name, metric, field) for metric in metrics for field in ('count', 'total')]
+        values = cache.get_many(keys) if keys else {}
+        stats = {}
+        for metric in metrics:
+            count = values.get(self._key(name, metric, 'count'))
+            if count:
+                total = values.get(self._key(name, metric, 'total'), 0) / self.SCALES.get(metric, 1)
+                stats[metric] = {'count': count, 'total': total}
+        return stats
+
+    def keyspace(self, name):
+        """ Estimates the number and total size of keys stored under name
+            which have not expired yet: keys stored at the observed rate for
+            their mean timeout (Little's law), all of them if they don't
+            expire or the timeout is longer than the observed period.
+            Overwrites of the same key are counted as different keys.
+        """
+        stats = self.stats(name)
+        stored = stats.get('stored_bytes', {'count': 0, 'total': 0})
+        if not stored['count']:
+            return 0, 0
+        since = caches[self.backend].get(self.prefix + 'since') or time.time()
+        period = max(time.time() - since, 1)
+        expiring = stats.get('stored_ttl', {'count': 0, 'total': 0})
+        keys = stored['count'] - expiring['count']
+        if expiring['count']:
+            mean_ttl = float(expiring['total']) / expiring['count']
+            keys += expiring['count'] * min(mean_ttl / period, 1)
+        keys = int(round(keys))
+        return keys, int(keys * float(stored['total']) / stored['count'])
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._known.clear()
+        cache = caches[self.backend]
+        index = cache.get(self.prefix + 'index') or {}
+        keys = [self._key(name, metric, field) for name, metrics in index.items()
+                for metric in metrics for field in ('count', 'total')]
+        cache.delete_many(keys + [self.prefix + 'index', self.prefix + 'since'])
+
+
+memory = MemorySink()
+
+
+def add_sink(sink):
+    global enabled
+    if sink not in _sinks:
+        _sinks.append(sink)
+    enabled = True
+
+
+def remove_sink(sink):
+    global enabled
+    if sink in _sinks:
+        _sinks.remove(sink)
+    enabled = bool(_sinks)
+
+
+def sinks():
+    return list(_sinks)
+
+
+def record(name, metric, value=1):
+    for sink in _sinks:
+        sink.record(name, metric, value)
+
+
+def record_key(name, key, size, timeout):
+    """ Tracks a stored key for the key space reports of `memory` and
+        `CacheSink`.
+    """
+    for sink in _sinks:
+        if hasattr(sink, 'record_key'):
+            sink.record_key(name, key, size, timeout)
+
+
+def forget_key(name, key):
+    if memory in _sinks:
+        memory.forget_key(name, key)
+
+
+def clock():
+    """ Returns the start time for `record_time`, None if disabled """
+    return time.perf_counter() if enabled else None
+
+
+def record_time(name, metric, started):
+    if started is not None:
+        record(name, metric, time.perf_counter() - started)
+
+
+def _load_sinks():
+    for path in getattr(settings, 'CACHE_UTILS_METRICS', ()):
+        sink = import_string(path)
+        add_sink(sink() if isinstance(sink, type) else sink)
+
+
+_load_sinks()
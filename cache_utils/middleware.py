@@ -0,0 +1,37 @@
+import asyncio
+
+try:
+    from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+except ImportError:  # asgiref < 3.6
+    iscoroutinefunction = asyncio.iscoroutinefunction
+    markcoroutinefunction = None
+
+from cache_utils.memo import request_memo
+
+
+class RequestMemoMiddleware(object):
+    """ Remembers results of cached functions until the end of the request,
+        so repeated calls with the same arguments skip the cache backend.
+        Works under WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            if markcoroutinefunction is not None:
+                markcoroutinefunction(self)
+            else:
+                self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with request_memo():
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with request_memo():
+            return await self.get_response(request)
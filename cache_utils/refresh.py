@@ -0,0 +1,73 @@
+"""
+Revalidation of stale values for the `cached` decorator. Values are stored
+in an `Envelope` with a soft expiry time; after it passes the value is still
+served while one caller, or a background thread, recalculates it.
+"""
+
+import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger("cache_utils")
+
+# Value stored by `cached` with `stale_ttl`. It is a plain pickleable tuple,
+# so it works with any cache backend.
+Envelope = namedtuple('Envelope', ['value', 'soft_expiry'])
+
+REFRESH_WORKERS = getattr(settings, 'CACHE_UTILS_REFRESH_WORKERS', 4)
+# refreshes beyond this number are dropped, the next reader retries them
+REFRESH_MAX_PENDING = getattr(settings, 'CACHE_UTILS_REFRESH_MAX_PENDING', 1000)
+
+
+class Refresher(object):
+    """ Deduplicates refreshes per key and runs background ones in a
+        bounded thread pool.
+    """
+
+    def __init__(self, max_workers=REFRESH_WORKERS, max_pending=REFRESH_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def claim(self, key):
+        """ Returns True if the caller should refresh key, False if it is
+            already being refreshed in this process.
+        """
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+            self._pending.add(key)
+            return True
+
+    def release(self, key):
+        with self._lock:
+            self._pending.discard(key)
+
+    def submit(self, key, fn):
+        """ Runs fn in the pool unless key is already being refreshed. """
+        if not self.claim(key):
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self._executor.submit(self._run, key, fn)
+
+    def _run(self, key, fn):
+        try:
+            return fn()
+        except Exception:
+            logger.exception("Cache REFRESH failed: %s", key)
+        finally:
+            self.release(key)
+            # database connections are per thread, don't leak them
+            connections.close_all()
+
+
+refresher = Refresher()
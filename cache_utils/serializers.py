@@ -0,0 +1,169 @@
+"""
+Pluggable value serialization with transparent compression.
+
+`Codec.dumps` returns a compact binary envelope: a magic byte, a byte with
+the serializer and compressor ids and the payload. `Codec.loads` reads the
+ids from the envelope, so values written with other settings still load.
+msgpack, orjson and lz4 are optional and used only if installed.
+"""
+
+import json
+import pickle
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+MAGIC = 0xCA
+
+# values smaller than this are stored uncompressed
+DEFAULT_COMPRESS_THRESHOLD = 1024
+
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+
+# values of other types, like the `Envelope` and `CACHED_NONE` stored by
+# `cached`, are pickled whatever the serializer is
+PLAIN_TYPES = (dict, list, tuple, str, bytes, int, float, bool, type(None))
+
+
+class PickleSerializer(object):
+    id = 1
+
+    def dumps(self, value):
+        return pickle.dumps(value, PICKLE_PROTOCOL)
+
+    def loads(self, data):
+        return pickle.loads(data)
+
+
+class JSONSerializer(object):
+    """ For JSON-safe values only: tuples come back as lists etc. """
+    id = 2
+
+    def dumps(self, value):
+        if orjson is not None:
+            return orjson.dumps(value)
+        return json.dumps(value, separators=(',', ':')).encode()
+
+    def loads(self, data):
+        if orjson is not None:
+            return orjson.loads(data)
+        return json.loads(data.decode())
+
+
+class MsgpackSerializer(object):
+    id = 3
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError("msgpack serializer requires the msgpack package")
+
+    def dumps(self, value):
+        return msgpack.packb(value, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class ZlibCompressor(object):
+    id = 1
+
+    def compress(self, data):
+        return zlib.compress(data)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+
+class LZ4Compressor(object):
+    id = 2
+
+    def __init__(self):
+        if lz4 is None:
+            raise ImportError("lz4 compressor requires the lz4 package")
+
+    def compress(self, data):
+        return lz4.frame.compress(data)
+
+    def decompress(self, data):
+        return lz4.frame.decompress(data)
+
+
+SERIALIZERS = {
+    'pickle': PickleSerializer,
+    'json': JSONSerializer,
+    'msgpack': MsgpackSerializer,
+}
+
+COMPRESSORS = {
+    'zlib': ZlibCompressor,
+    'lz4': LZ4Compressor,
+}
+
+
+def _get(registry, name, kind):
+    if name not in registry:
+        raise ValueError("Unknown %s %r, expected one of: %s" % (kind, name, ", ".join(sorted(registry))))
+    return registry[name]()
+
+
+def _by_id(registry, id):
+    for cls in registry.values():
+        if cls.id == id:
+            return cls()
+    raise ValueError("Unknown serialization id %d" % id)
+
+
+class Codec(object):
+    """ Serializes values with `serializer` and compresses the ones which are
+        at least `compress_threshold` bytes long with `compressor`. Values
+        which are not of `PLAIN_TYPES` are pickled.
+    """
+
+    def __init__(self, serializer='pickle', compressor='zlib', compress_threshold=DEFAULT_COMPRESS_THRESHOLD):
+        self.serializer = _get(SERIALIZERS, serializer, 'serializer')
+        self.compressor = _get(COMPRESSORS, compressor, 'compressor') if compressor else None
+        self.compress_threshold = compress_threshold
+        self._pickle = PickleSerializer()
+
+    def dumps(self, value):
+        serializer = self.serializer if type(value) in PLAIN_TYPES else self._pickle
+        data = serializer.dumps(value)
+        compressor_id = 0
+        if self.compressor is not None and len(data) >= self.compress_threshold:
+            compressed = self.compressor.compress(data)
+            if len(compressed) < len(data):
+                data, compressor_id = compressed, self.compressor.id
+        return bytes((MAGIC, serializer.id << 4 | compressor_id)) + data
+
+    def loads(self, data):
+        """ Loads a value dumped by any Codec """
+        if len(data) < 2 or data[0] != MAGIC:
+            raise ValueError("Not a cache_utils serialized value")
+        serializer_id, compressor_id = data[1] >> 4, data[1] & 0x0F
+        data = data[2:]
+        if compressor_id:
+            data = _by_id(COMPRESSORS, compressor_id).decompress(data)
+        return _by_id(SERIALIZERS, serializer_id).loads(data)
+
+
+def get_codec(serializer):
+    """ Returns a Codec for a serializer name; Codec instances are returned
+        as they are and None stays None.
+    """
+    if serializer is None or isinstance(serializer, Codec):
+        return serializer
+    return Codec(serializer)
@@ -1,14 +1,38 @@
 # -*- coding: utf-8 -*-
 
+import asyncio
 import inspect
-
-from django.http import HttpRequest
-from unittest import TestCase
-
-from django.core.cache import cache
-
-from cache_utils.decorators import cached
-from cache_utils.utils import _cache_key, sanitize_memcached_key, _func_type, _func_info, stringify_args
+import pickle
+import threading
+import time
+from hashlib import blake2b, sha256
+from io import StringIO
+
+import pymemcache
+from django.http import HttpRequest, HttpResponse
+from unittest import TestCase, mock, skipUnless
+
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.db import connection, models, transaction
+
+import cache_utils.cache
+from cache_utils import adaptive, chunks, group_backend, locks, memo, metrics, serializers
+from cache_utils.group_backend import CacheClass
+from cache_utils.instances import cached_instances, get_instances
+from cache_utils.management.commands.cache_utils_report import function_report
+from cache_utils.memo import request_memo
+from cache_utils.middleware import RequestMemoMiddleware, iscoroutinefunction
+from cache_utils.decorators import (
+    NoCachedValueException, bulk_update, cached, defer_invalidation, invalidate_model, invalidate_tags,
+)
+from cache_utils.views import cached_view
+from cache_utils.warmup import warm
+from cache_utils.utils import (
+    _cache_key, _func_info, _func_type, make_key_builder, readable_key, sanitize_memcached_key, stringify_args,
+)
 
 
 def foo(a, b):
@@ -31,6 +55,22 @@ class MyObject:
         self.b = b
 
 
+class Product(models.Model):
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'cache_utils'
+
+
+class Shop(models.Model):
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100)
+
+    class Meta:
+        app_label = 'cache_utils'
+
+
 class Store(object):
     """ Class for encoding error test """
 
@@ -41,6 +81,23 @@ class Store(object):
         return u'Вася'.encode('utf8')
 
 
+warmed_calls = []
+
+
+@cached(60, backend='locmem')
+def warmed_square(x, y=1):
+    warmed_calls.append(x)
+    return x * x * y
+
+
+def warm_arguments():
+    return iter([1, 2, (3, 2)])
+
+
+# pymemcache client options and serdes are used on Django >= 3.2 only
+requires_pymemcache = skipUnless(caches['default']._options.get('serde') is not None, "requires Django >= 3.2")
+
+
 class FuncTypeTest(TestCase):
 
     def assertFuncType(self, func, tp):
@@ -85,14 +142,22 @@ class SanitizeTest(TestCase):
         key = sanitize_memcached_key(key, 40)
         self.assertTrue(len(key) <= 71)
 
+    def test_long_keys_keep_prefix(self):
+        key = '[cached]app.views.report:10(%s)' % ('x' * 300)
+        sanitized = sanitize_memcached_key(key)
+        self.assertEqual(len(sanitized), 250)
+        self.assertTrue(sanitized.startswith('[cached]app.views.report:10(xxx'))
+        self.assertNotEqual(sanitized, sanitize_memcached_key(key + 'y'))
+        self.assertLessEqual(len(sanitize_memcached_key(u'й' * 200).encode()), 250)
+
 
 class ClearMemcachedTest(TestCase):
 
     def tearDown(self):
-        cache._cache.flush_all()
+        cache.clear()
 
     def setUp(self):
-        cache._cache.flush_all()
+        cache.clear()
 
 
 class InvalidationTest(ClearMemcachedTest):
@@ -114,6 +179,121 @@ class InvalidationTest(ClearMemcachedTest):
         cache.set('vasia', 'foo', 60, group='names')
         self.assertEqual(cache.get('vasia', group='names'), 'foo')
 
+    def test_group_invalidation_many(self):
+        cache.set_many({'vasia': 'foo', 'petya': 'bar'}, 60, group='names')
+        self.assertEqual(cache.get_many(['vasia', 'petya', 'kolya'], group='names'), {'vasia': 'foo', 'petya': 'bar'})
+        self.assertEqual(cache.get('vasia', group='names'), 'foo')
+
+        cache.delete_many(['vasia'], group='names')
+        self.assertEqual(cache.get_many(['vasia', 'petya'], group='names'), {'petya': 'bar'})
+
+        cache.invalidate_group('names')
+        self.assertEqual(cache.get_many(['vasia', 'petya'], group='names'), {})
+
+    def test_get_many_hashkey_fetched_once(self):
+        cache.set_many({'a': 1, 'b': 2, 'c': 3}, 60, group='letters')
+        with mock.patch.object(cache, '_get_hashkey', wraps=cache._get_hashkey) as get_hashkey:
+            self.assertEqual(cache.get_many(['a', 'b', 'c'], group='letters'), {'a': 1, 'b': 2, 'c': 3})
+        self.assertLessEqual(get_hashkey.call_count, 1)
+
+    def test_group_get_single_round_trip(self):
+        cache.set('a', 1, 60, group='letters')
+        with mock.patch.object(cache._cache, 'get', wraps=cache._cache.get) as get, \
+                mock.patch.object(cache._cache, 'get_multi', wraps=cache._cache.get_multi) as get_many:
+            self.assertEqual(cache.get('a', group='letters'), 1)
+            self.assertEqual(cache.get_many(['a', 'b'], group='letters'), {'a': 1})
+        self.assertEqual((get.call_count, get_many.call_count), (0, 2))
+
+        # hashkey replaced by another process is noticed by the next read
+        cache._cache.set(cache._group_key('letters'), 'other', noreply=False)
+        self.assertEqual(cache.get('a', group='letters'), None)
+        self.assertEqual(cache._known_hashkey('letters'), 'other')
+        cache.set('a', 2, 60, group='letters')
+        self.assertEqual(cache.get('a', group='letters'), 2)
+
+        # a deleted group key, as invalidated by older versions, invalidates
+        # the group even if its hashkey is kept in process
+        cache._cache.delete(cache._group_key('letters'), noreply=False)
+        self.assertEqual(cache.get('a', group='letters'), None)
+        self.assertNotEqual(cache._known_hashkey('letters'), 'other')
+        cache.set('a', 3, 60, group='letters')
+        cache._cache.delete(cache._group_key('letters'), noreply=False)
+        group_backend._hashkeys.clear()
+        self.assertEqual(cache.get('a', group='letters'), None)
+        cache.set('a', 4, 60, group='letters')
+        cache.invalidate_group('letters')
+        self.assertEqual(cache.get('a', group='letters'), None)
+
+    def test_counters(self):
+        self.assertRaises(ValueError, cache.incr, 'hits', group='counters')
+        self.assertEqual(cache.incr('hits', group='counters', initial=0), 1)
+        self.assertEqual(cache.incr('hits', 5, group='counters'), 6)
+        self.assertEqual(cache.decr('hits', 2, group='counters'), 4)
+        self.assertEqual(cache.get('hits', group='counters'), 4)
+
+        cache.set('value', 'foo', 60, group='counters')
+        self.assertEqual(cache.get_many(['hits', 'value'], group='counters'), {'hits': 4, 'value': 'foo'})
+        self.assertEqual(cache.incr_many({'hits': 1, 'misses': 1}, group='counters'), {'hits': 5})
+        self.assertEqual(cache.incr_many({'hits': -1, 'misses': 1}, group='counters', initial=10),
+                         {'hits': 4, 'misses': 11})
+        cache.incr_many({'hits': 2}, group='counters', noreply=True)
+        self.assertEqual(cache.get('hits', group='counters'), 6)
+
+        # counters are namespaced by group
+        self.assertEqual(cache.get('hits'), None)
+        cache.invalidate_group('counters')
+        self.assertEqual(cache.get('hits', group='counters'), None)
+
+    @requires_pymemcache
+    def test_client_options(self):
+        backend = CacheClass('127.0.0.1:11211', {'OPTIONS': {
+            'CONNECT_TIMEOUT': 1, 'TIMEOUT': 2, 'DEAD_TIMEOUT': 30, 'retry_attempts': 1, 'RETRY_ATTEMPTS': 5,
+            'HASHER': 'pymemcache.client.rendezvous.RendezvousHash'}})
+        self.assertEqual(backend._options['connect_timeout'], 1)
+        self.assertEqual(backend._options['timeout'], 2)
+        self.assertEqual(backend._options['dead_timeout'], 30)
+        self.assertEqual(backend._options['retry_attempts'], 1)
+        self.assertTrue(backend._options['no_delay'])
+        self.assertNotIn('use_pooling', backend._options)
+        self.assertEqual(backend._cache.hasher.__class__.__name__, 'RendezvousHash')
+
+    @requires_pymemcache
+    def test_connection_pool(self):
+        params = {'OPTIONS': {'POOL': True, 'POOL_SIZE': 4}}
+        backend = CacheClass('127.0.0.1:11211', params)
+        self.assertTrue(backend._options['use_pooling'])
+        self.assertEqual(backend._options['max_pool_size'], 4)
+        clients = []
+        thread = threading.Thread(target=lambda: clients.append(CacheClass('127.0.0.1:11211', params)._cache))
+        thread.start()
+        thread.join()
+        # one pool per process, kept open at the end of requests
+        self.assertIs(clients[0], backend._cache)
+        self.assertIsNot(CacheClass('127.0.0.1:11211', {'OPTIONS': {'POOL': True}})._cache, backend._cache)
+        backend.set('pooled', 1, 60)
+        backend.close()
+        self.assertEqual(backend.get('pooled'), 1)
+
+    def test_clear(self):
+        cache.set('vasia', 'foo', 60, group='names')
+        clients = getattr(cache._cache, 'clients', None)
+        client = clients['127.0.0.1:11211'] if clients else cache._cache
+        with mock.patch.object(client, 'flush_all') as flush_all:
+            cache.clear()
+        flush_all.assert_called_once_with()
+        self.assertNotIn((tuple(cache._servers), cache._group_key('names')), group_backend._hashkeys)
+
+    def test_mint_stale(self):
+        cache.set('vasia', 'foo', 60, group='names')
+        cache.set_many({'petya': 'bar'}, 60, group='names')
+        later = time.time() + 61
+        with mock.patch('cache_utils.group_backend.time.time', return_value=later):
+            # the first reader after expiry recalculates, the others get the stale value
+            self.assertEqual(cache.get('vasia', group='names'), None)
+            self.assertEqual(cache.get('vasia', group='names'), 'foo')
+            self.assertEqual(cache.get_many(['vasia', 'petya'], group='names'), {'vasia': 'foo'})
+            self.assertEqual(cache.get_many(['vasia', 'petya'], group='names'), {'vasia': 'foo', 'petya': 'bar'})
+
     def test_func_invalidation(self):
         self.call_count = 0
 
@@ -156,6 +336,24 @@ class InvalidationTest(ClearMemcachedTest):
 
 class DecoratorTest(ClearMemcachedTest):
 
+    def test_threads(self):
+        @cached(60)
+        def double(x):
+            return x * 2
+
+        results = []
+
+        def worker():
+            results.extend(double(i % 5) for i in range(50))
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            # each thread uses its own backend and memcached connection
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual(sorted(results), sorted([i % 5 * 2 for i in range(50)] * 4))
+
     def test_decorator(self):
         self._x = 0
 
@@ -241,6 +439,1009 @@ class DecoratorTest(ClearMemcachedTest):
         self.assertEqual(my_func(long_param2), 2)
 
 
+class GetManyTest(ClearMemcachedTest):
+
+    def setUp(self):
+        super(GetManyTest, self).setUp()
+        self.calls = []
+
+        @cached(60)
+        def my_func(a, b=0):
+            self.calls.append((a, b))
+            return a + b
+        self.my_func = my_func
+
+    def test_get_many(self):
+        self.assertEqual(self.my_func(1, 1), 2)
+        results = self.my_func.get_many([((1,), {'b': 1}), ((1, 1), {}), ((2,), {}), ((2,), {})])
+        self.assertEqual(results, [2, 2, 2, 2])
+        # (1, 1) as kwargs is a different key, like with a plain call; (2,) is computed once
+        self.assertEqual(self.calls, [(1, 1), (1, 1), (2, 0)])
+        self.assertEqual(self.my_func(2), 2)
+        self.assertEqual(len(self.calls), 3)
+
+    def test_get_many_loader(self):
+        loaded = []
+
+        def loader(calls):
+            loaded.append(calls)
+            return [args[0] * 10 for args, kwargs in calls]
+
+        self.assertEqual(self.my_func(1), 1)
+        self.assertEqual(self.my_func.get_many([((1,), {}), ((2,), {})], loader=loader), [1, 20])
+        self.assertEqual(loaded, [[((2,), {})]])
+        self.assertEqual(self.my_func(2), 20)
+
+    def test_map(self):
+        self.assertEqual(self.my_func.map([1, 2], [3, 4]), [4, 6])
+        self.assertEqual(self.my_func.map([1, 2], [3, 4]), [4, 6])
+        self.assertEqual(self.calls, [(1, 3), (2, 4)])
+        self.assertEqual(self.my_func.map([]), [])
+
+
+class LocalCacheTest(ClearMemcachedTest):
+
+    def setUp(self):
+        super(LocalCacheTest, self).setUp()
+        self.call_count = 0
+
+        @cached(60, group='local-group', local_ttl=10, local_maxsize=2)
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+        self.my_func = my_func
+
+    def test_local_hit(self):
+        self.assertEqual(self.my_func(1), 1)
+        cache._cache.flush_all()
+        self.assertEqual(self.my_func(1), 1)
+        self.assertEqual(self.my_func.cache_info(), {
+            'local': {'hits': 1, 'misses': 1},
+            'backend': {'hits': 0, 'misses': 1},
+        })
+
+    def test_local_invalidation(self):
+        self.assertEqual(self.my_func(1), 1)
+        self.my_func.invalidate(1)
+        self.assertEqual(self.my_func(1), 2)
+        cache.invalidate_group('local-group')
+        self.assertEqual(self.my_func(1), 3)
+
+    def test_local_expiry_and_size(self):
+        self.assertEqual(self.my_func(1), 1)
+        self.assertEqual(self.my_func(2), 2)
+        self.assertEqual(self.my_func(3), 3)
+        cache._cache.flush_all()
+        # 1 was evicted by the LRU, 2 and 3 are still local
+        self.assertEqual(self.my_func(2), 2)
+        self.assertEqual(self.my_func(1), 4)
+        later = time.monotonic() + 11
+        cache._cache.flush_all()
+        self.assertEqual(self.my_func(1), 4)
+        with mock.patch('cache_utils.local.time.monotonic', return_value=later):
+            self.assertEqual(self.my_func(1), 5)
+
+
+class ModelInvalidationTest(ClearMemcachedTest):
+
+    def setUp(self):
+        super(ModelInvalidationTest, self).setUp()
+        self.call_count = 0
+
+        @cached(60, model_list=[Product])
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+        self.my_func = my_func
+
+    def test_invalidate_model(self):
+        self.assertEqual(self.my_func(1), 1)
+        self.assertEqual(self.my_func(2), 2)
+        key = self.my_func.get_cache_key(1)
+
+        models.signals.post_save.send(sender=Product, instance=Product(name='x'))
+        self.assertNotEqual(self.my_func.get_cache_key(1), key)
+        self.assertEqual(self.my_func(1), 3)
+        self.assertEqual(self.my_func(2), 4)
+        self.assertEqual(self.my_func.get_many([((1,), {}), ((2,), {})]), [3, 4])
+
+    def test_post_delete(self):
+        self.assertEqual(self.my_func(1), 1)
+        models.signals.post_delete.send(sender=Product, instance=Product(name='x'))
+        self.assertEqual(self.my_func(1), 2)
+
+    def test_unregistered_model(self):
+        self.assertEqual(self.my_func(1), 1)
+        with mock.patch.object(cache, 'delete_many') as cache_delete_many:
+            models.signals.post_save.send(sender=Shop, instance=Shop(name='x'))
+            invalidate_model(Shop)
+        self.assertFalse(cache_delete_many.called)
+        self.assertEqual(self.my_func(1), 1)
+
+    def test_defer_invalidation(self):
+        self.assertEqual(self.my_func(1), 1)
+        with mock.patch.object(cache, 'delete_many', wraps=cache.delete_many) as cache_delete_many:
+            with defer_invalidation():
+                for i in range(5):
+                    models.signals.post_save.send(sender=Product, instance=Product(name='x'))
+                with defer_invalidation():
+                    models.signals.post_save.send(sender=Product, instance=Product(name='y'))
+                self.assertEqual(self.my_func(1), 1)
+        self.assertEqual(cache_delete_many.call_count, 1)
+        self.assertEqual(self.my_func(1), 2)
+
+    def test_hit_does_not_write(self):
+        self.assertEqual(self.my_func(1), 1)
+        with mock.patch.object(cache, 'set') as cache_set, mock.patch.object(cache, 'add') as cache_add:
+            self.assertEqual(self.my_func(1), 1)
+        self.assertFalse(cache_set.called)
+        self.assertFalse(cache_add.called)
+
+
+class TagTest(TestCase):
+
+    def setUp(self):
+        caches['locmem'].clear()
+        self.calls = []
+
+        @cached(60, backend='locmem', tags=lambda store, user: ['store:%s' % store, 'user:%s' % user])
+        def my_func(store, user):
+            self.calls.append((store, user))
+            return len(self.calls)
+        self.my_func = my_func
+
+    def test_invalidate_tags(self):
+        self.assertEqual([self.my_func(1, 1), self.my_func(1, 2), self.my_func(2, 1)], [1, 2, 3])
+        self.assertEqual([self.my_func(1, 1), self.my_func(1, 2), self.my_func(2, 1)], [1, 2, 3])
+
+        invalidate_tags(['user:1'])
+        self.assertEqual([self.my_func(1, 1), self.my_func(1, 2), self.my_func(2, 1)], [4, 2, 5])
+        invalidate_tags(['store:1'])
+        self.assertEqual([self.my_func(1, 1), self.my_func(1, 2), self.my_func(2, 1)], [6, 7, 5])
+
+    def test_get_many(self):
+        self.assertEqual(self.my_func.get_many([((1, 1), {}), ((2, 2), {})]), [1, 2])
+        invalidate_tags(['store:2'])
+        self.assertEqual(self.my_func.get_many([((1, 1), {}), ((2, 2), {})]), [1, 3])
+        self.assertEqual(self.my_func(2, 2), 3)
+
+    def test_method(self):
+        calls = []
+
+        class Store(object):
+            @cached(60, backend='locmem', tags=lambda user: ['user:%s' % user])
+            def visits(self, user):
+                calls.append(user)
+                return len(calls)
+
+        store = Store()
+        self.assertEqual(store.visits(1), 1)
+        self.assertEqual(store.visits(1), 1)
+        invalidate_tags(['user:1'])
+        self.assertEqual(store.visits(1), 2)
+        store.visits.invalidate(1)
+        self.assertEqual(store.visits(1), 3)
+
+
+class RequestMemoTest(TestCase):
+
+    def setUp(self):
+        caches['locmem'].clear()
+        self.call_count = 0
+
+        @cached(60, backend='locmem', tags=['memo'])
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+        self.my_func = my_func
+
+    def test_memo(self):
+        with mock.patch.object(caches['locmem'], 'get', wraps=caches['locmem'].get) as get:
+            with request_memo():
+                self.assertEqual([self.my_func(1), self.my_func(1), self.my_func(1)], [1, 1, 1])
+                self.assertEqual(get.call_count, 1)
+
+                self.my_func.invalidate(1)
+                self.assertEqual(self.my_func(1), 2)
+                self.assertEqual(self.my_func.force_recalc(1), 3)
+                self.assertEqual(self.my_func(1), 3)
+                self.assertEqual(get.call_count, 2)
+
+                invalidate_tags(['memo'])
+                self.assertEqual(self.my_func(1), 4)
+                self.assertEqual(get.call_count, 3)
+
+            self.assertEqual(memo.current(), None)
+            self.assertEqual(self.my_func(1), 4)
+            self.assertEqual(get.call_count, 4)
+
+    def test_middleware(self):
+        def get_response(request):
+            return [self.my_func(1), self.my_func(1), len(memo.current())]
+
+        middleware = RequestMemoMiddleware(get_response)
+        self.assertEqual(middleware(HttpRequest()), [1, 1, 1])
+        self.assertEqual(memo.current(), None)
+
+    def test_async_middleware(self):
+        async def get_response(request):
+            memo.current()[request] = request
+            await asyncio.sleep(0.01)
+            return sorted(memo.current(), key=id)
+
+        middleware = RequestMemoMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+
+        async def main():
+            requests = [HttpRequest(), HttpRequest()]
+            responses = await asyncio.gather(*[middleware(request) for request in requests])
+            self.assertEqual(responses, [[request] for request in requests])
+
+        asyncio.run(main())
+
+
+class NegativeCacheTest(ClearMemcachedTest):
+
+    def setUp(self):
+        super(NegativeCacheTest, self).setUp()
+        self.calls = []
+
+    def test_none_not_cached_by_default(self):
+        @cached(60)
+        def my_func(a):
+            self.calls.append(a)
+            return {'none': None, 'empty': [], 'zero': 0}[a]
+
+        self.assertEqual(my_func('none'), None)
+        self.assertEqual(my_func('none'), None)
+        self.assertEqual(self.calls, ['none', 'none'])
+        self.assertRaises(NoCachedValueException, my_func.require_cache, 'none')
+
+    def test_falsy_values(self):
+        @cached(60)
+        def my_func(a):
+            self.calls.append(a)
+            return {'none': None, 'empty': [], 'zero': 0}[a]
+
+        self.assertEqual(my_func('zero'), 0)
+        self.assertEqual(my_func('zero'), 0)
+        self.assertEqual(my_func.require_cache('zero'), 0)
+        self.assertEqual(my_func('empty'), [])
+        self.assertEqual(my_func.require_cache('empty'), [])
+        self.assertEqual(self.calls, ['zero', 'empty'])
+
+    def test_negative_caching(self):
+        @cached(60, negative_timeout=10, local_ttl=10)
+        def my_func(a):
+            self.calls.append(a)
+            return {'none': None, 'empty': [], 'zero': 0}[a]
+
+        self.assertRaises(NoCachedValueException, my_func.require_cache, 'none')
+        self.assertEqual(my_func('none'), None)
+        self.assertEqual(my_func('none'), None)
+        self.assertEqual(my_func.require_cache('none'), None)
+        self.assertEqual(my_func.force_recalc('none'), None)
+        self.assertEqual(my_func.get_many([(('none',), {}), (('empty',), {})]), [None, []])
+        self.assertEqual(my_func.get_many([(('none',), {}), (('empty',), {})]), [None, []])
+        self.assertEqual(self.calls, ['none', 'none', 'empty'])
+
+    def test_negative_timeout(self):
+        @cached(60, negative_timeout=10)
+        def my_func(a):
+            self.calls.append(a)
+            return {'none': None, 'empty': [], 'zero': 0}[a]
+
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            my_func('empty')
+            my_func('zero')
+        self.assertEqual([call[0][2] for call in cache_set.call_args_list], [10, 60])
+
+
+class AsyncTest(ClearMemcachedTest):
+
+    def setUp(self):
+        super(AsyncTest, self).setUp()
+        self.call_count = 0
+
+    def test_async_function(self):
+        @cached(60, group='async-group')
+        async def my_func(a):
+            await asyncio.sleep(0.05)
+            self.call_count += 1
+            return self.call_count
+
+        self.assertTrue(inspect.iscoroutinefunction(my_func))
+
+        async def run():
+            self.assertEqual(await my_func(1), 1)
+            self.assertEqual(await my_func(1), 1)
+            self.assertEqual(await my_func(2), 2)
+            self.assertEqual(await my_func.arequire_cache(2), 2)
+            self.assertEqual(await my_func.aget_cache_key(2), my_func.get_cache_key(2))
+            await my_func.ainvalidate(2)
+            with self.assertRaises(NoCachedValueException):
+                await my_func.arequire_cache(2)
+            self.assertEqual(await my_func(2), 3)
+            self.assertEqual(await my_func.aforce_recalc(1), 4)
+            self.assertEqual(await my_func(1), 4)
+        asyncio.run(run())
+        self.assertEqual(my_func.require_cache(1), 4)
+
+    def test_concurrent_awaiters(self):
+        @cached(60, model_list=[Product])
+        async def my_func(a):
+            await asyncio.sleep(0.05)
+            self.call_count += 1
+            return self.call_count
+
+        async def run():
+            return await asyncio.gather(*[my_func(1) for i in range(5)])
+        self.assertEqual(asyncio.run(run()), [1] * 5)
+        self.assertEqual(self.call_count, 1)
+
+    def test_background_refresh(self):
+        @cached(60, backend='locmem', stale_ttl=60, refresh='background')
+        async def my_func(a):
+            await asyncio.sleep(0.05)
+            self.call_count += 1
+            return self.call_count
+
+        async def run():
+            self.assertEqual(await my_func(1), 1)
+            with mock.patch('time.time', return_value=time.time() + 61):
+                self.assertEqual(await my_func(1), 1)
+                await asyncio.sleep(0.2)
+                self.assertEqual(await my_func(1), 2)
+        asyncio.run(run())
+
+    def test_unsupported(self):
+        async def my_func(a):
+            return a
+
+        with mock.patch('cache_utils.decorators.sync_to_async', None):
+            self.assertRaises(ImproperlyConfigured, cached(60), my_func)
+
+    def test_sync_function_async_methods(self):
+        @cached(60)
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+
+        async def run():
+            self.assertEqual(await my_func.aforce_recalc(1), 1)
+            self.assertEqual(await my_func.arequire_cache(1), 1)
+            await my_func.ainvalidate(1)
+        asyncio.run(run())
+        self.assertEqual(my_func(1), 2)
+
+
+class CachedViewTest(ClearMemcachedTest):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.renders = 0
+
+        @cached_view(60, group='views', model_list=[Product])
+        def page(request, slug):
+            self.renders += 1
+            response = HttpResponse('%s %s %s' % (slug, request.GET.get('q'), self.renders))
+            if slug == 'private':
+                response['Cache-Control'] = 'private'
+            return response
+        self.page = page
+
+    def test_cached_view(self):
+        response = self.page(self.factory.get('/a/?q=1'), 'a')
+        self.assertEqual(response.content, b'a 1 1')
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        response = self.page(self.factory.get('/a/?q=1'), 'a')
+        self.assertEqual((response.status_code, response.content, response['ETag']), (200, b'a 1 1', etag))
+        self.assertEqual(self.page(self.factory.get('/a/?q=2'), 'a').content, b'a 2 2')
+        self.assertEqual(self.page(self.factory.post('/a/?q=1'), 'a').content, b'a 1 3')
+        self.assertEqual(self.page(self.factory.get('/a/', {'q': 1}), 'private').content, b'private 1 4')
+        self.assertEqual(self.page(self.factory.get('/a/', {'q': 1}), 'private').content, b'private 1 5')
+
+        models.signals.post_save.send(sender=Product, instance=Product(name='x'))
+        self.assertEqual(self.page(self.factory.get('/a/?q=1'), 'a').content, b'a 1 6')
+        cache.invalidate_group('views')
+        self.assertEqual(self.page(self.factory.get('/a/?q=1'), 'a').content, b'a 1 7')
+        self.page.invalidate(self.factory.get('/a/?q=1'), 'a')
+        self.assertEqual(self.page(self.factory.get('/a/?q=1'), 'a').content, b'a 1 8')
+
+    def test_not_modified(self):
+        response = self.page(self.factory.get('/a/'), 'a')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        with mock.patch.object(cache, 'get', wraps=cache.get) as cache_get:
+            response = self.page(self.factory.get('/a/', HTTP_IF_NONE_MATCH=etag), 'a')
+        self.assertEqual((response.status_code, response.content, response['ETag']), (304, b'', etag))
+        # the body is not fetched
+        self.assertEqual(cache_get.call_count, 1)
+        response = self.page(self.factory.get('/a/', HTTP_IF_MODIFIED_SINCE=last_modified), 'a')
+        self.assertEqual(response.status_code, 304)
+
+        response = self.page(self.factory.get('/a/', HTTP_IF_NONE_MATCH='"other"'), 'a')
+        self.assertEqual((response.status_code, response.content), (200, b'a None 1'))
+        # conditional requests on a cold cache render and match too
+        etag = '"%s"' % blake2b(b'b None 2', digest_size=16).hexdigest()
+        response = self.page(self.factory.get('/b/', HTTP_IF_NONE_MATCH=etag), 'b')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.renders, 2)
+
+    def test_vary(self):
+        @cached_view(60)
+        def greeting(request):
+            response = HttpResponse('hello %s' % request.COOKIES.get('name'))
+            response['Vary'] = 'Cookie'
+            return response
+
+        @cached_view(60)
+        def localized(request):
+            response = HttpResponse(request.META.get('HTTP_ACCEPT_LANGUAGE'))
+            response['Vary'] = 'Accept-Language'
+            return response
+
+        request = self.factory.get('/greeting/')
+        request.COOKIES['name'] = 'alice'
+        self.assertEqual(greeting(request).content, b'hello alice')
+        request = self.factory.get('/greeting/')
+        request.COOKIES['name'] = 'bob'
+        self.assertEqual(greeting(request).content, b'hello bob')
+
+        self.assertEqual(localized(self.factory.get('/l/', HTTP_ACCEPT_LANGUAGE='en')).content, b'en')
+        self.assertEqual(localized(self.factory.get('/l/', HTTP_ACCEPT_LANGUAGE='de')).content, b'de')
+
+
+class SerializerTest(ClearMemcachedTest):
+
+    def test_codec(self):
+        codec = serializers.Codec('pickle', compress_threshold=100)
+        small, large = {'a': 1}, {'a': 'x' * 1000}
+        self.assertEqual(codec.loads(codec.dumps(small)), small)
+        self.assertEqual(codec.loads(codec.dumps(large)), large)
+        self.assertLess(len(codec.dumps(large)), 100)
+        self.assertEqual(codec.dumps(small)[1] & 0x0F, 0)
+
+        # values load whatever codec settings they were dumped with
+        json_codec = serializers.Codec('json', compressor=None)
+        self.assertEqual(codec.loads(json_codec.dumps(large)), large)
+        self.assertRaises(ValueError, codec.loads, b'plain bytes')
+        self.assertRaises(ValueError, serializers.Codec, 'yaml')
+
+    def test_decorator(self):
+        self.call_count = 0
+
+        @cached(60, serializer='json', stale_ttl=10, negative_timeout=10)
+        def my_func(a):
+            self.call_count += 1
+            return {'big': ['x' * 2000], 'small': {'count': self.call_count}, 'none': None}[a]
+
+        self.assertEqual(my_func('big'), ['x' * 2000])
+        self.assertEqual(my_func('small'), {'count': 2})
+        self.assertEqual(my_func('none'), None)
+        self.assertLess(len(cache.get(my_func.get_cache_key('big')).value), 100)
+
+        self.assertEqual(my_func('big'), ['x' * 2000])
+        self.assertEqual(my_func.require_cache('small'), {'count': 2})
+        self.assertEqual(my_func.get_many([(('big',), {}), (('none',), {})]), [['x' * 2000], None])
+        self.assertEqual(self.call_count, 3)
+
+    @requires_pymemcache
+    def test_group_backend_serde(self):
+        backend = CacheClass('127.0.0.1:11211', {'OPTIONS': {'SERIALIZER': 'pickle', 'COMPRESS_THRESHOLD': 100}})
+        value = {'rows': ['x' * 1000]}
+        backend.set('big', value, 60, group='serde')
+        backend.set_many({'small': 1}, 60, group='serde')
+        self.assertEqual(backend.get('big', group='serde'), value)
+        self.assertEqual(backend.get_many(['big', 'small'], group='serde'), {'big': value, 'small': 1})
+
+        # the stored item is a 9 byte header and the compressed value
+        raw = pymemcache.Client(('127.0.0.1', 11211)).get(backend._make_key('serde', 'big'))
+        self.assertLess(len(raw), 100)
+
+    @override_settings(CACHES={
+        'default': {'BACKEND': 'cache_utils.group_backend.CacheClass', 'LOCATION': '127.0.0.1:11211'},
+        'json': {'BACKEND': 'cache_utils.group_backend.CacheClass', 'LOCATION': '127.0.0.1:11211',
+                 'OPTIONS': {'SERIALIZER': 'json'}},
+    })
+    def test_group_backend_json(self):
+        self.call_count = 0
+
+        @cached(60, backend='json', negative_timeout=10)
+        def negative_func(a):
+            self.call_count += 1
+            return None
+
+        @cached(60, backend='json', stale_ttl=10)
+        def stale_func(a):
+            self.call_count += 1
+            return {'a': a}
+
+        # CACHED_NONE and Envelope are pickled
+        self.assertEqual(negative_func(1), None)
+        self.assertEqual(negative_func(1), None)
+        self.assertEqual(stale_func(1), {'a': 1})
+        self.assertEqual(stale_func(1), {'a': 1})
+        self.assertEqual(self.call_count, 2)
+        self.assertEqual(serializers.Codec('json').loads(serializers.Codec('json').dumps((1, 2))), [1, 2])
+
+
+class ChunkTest(ClearMemcachedTest):
+
+    def test_split_join(self):
+        data = b'x' * 250 + b'y' * 10
+        manifest, chunk_values = chunks.split(data, 100)
+        self.assertTrue(chunks.is_manifest(manifest))
+        self.assertEqual(len(chunk_values), 3)
+        parts = [chunk_values[key] for key in chunks.chunk_keys(manifest)]
+        self.assertEqual(chunks.join(manifest, parts), data)
+
+        # missing and mismatched chunks are a miss
+        self.assertEqual(chunks.join(manifest, parts[:2] + [None]), None)
+        self.assertEqual(chunks.join(manifest, parts[:2] + [b'z' * 60]), None)
+
+    def test_decorator(self):
+        self.call_count = 0
+
+        @cached(60, backend='locmem', chunk_size=100, stale_ttl=10)
+        def my_func(a):
+            self.call_count += 1
+            return ['x' * 50, a] * 20
+
+        caches['locmem'].clear()
+        self.assertEqual(my_func('a'), ['x' * 50, 'a'] * 20)
+        self.assertEqual(my_func('a'), ['x' * 50, 'a'] * 20)
+        self.assertEqual(my_func.get_many([(('a',), {}), (('b',), {})])[1], ['x' * 50, 'b'] * 20)
+        self.assertEqual(my_func.get_many([(('a',), {}), (('b',), {})])[1], ['x' * 50, 'b'] * 20)
+        self.assertEqual(self.call_count, 2)
+
+        manifest = caches['locmem'].get(my_func.get_cache_key('a')).value
+        caches['locmem'].delete(chunks.chunk_keys(manifest)[-1])
+        self.assertEqual(my_func('a'), ['x' * 50, 'a'] * 20)
+        self.assertEqual(self.call_count, 3)
+
+    @requires_pymemcache
+    def test_group_backend(self):
+        backend = CacheClass('127.0.0.1:11211', {'OPTIONS': {'CHUNK_SIZE': 100, 'COMPRESSOR': None}})
+        value = {'rows': ['x' * 1000]}
+        backend.set('big', value, 60, group='chunks')
+        backend.set_many({'big2': value, 'small': 1}, 60, group='chunks')
+        self.assertEqual(backend.get('big', group='chunks'), value)
+        self.assertEqual(backend.get_many(['big', 'big2', 'small'], group='chunks'),
+                         {'big': value, 'big2': value, 'small': 1})
+
+        client = pymemcache.Client(('127.0.0.1', 11211))
+        manifest = client.get(backend._make_key('chunks', 'big'))[9:]
+        self.assertTrue(chunks.is_manifest(manifest))
+        client.delete(backend._chunk_keys(manifest)[0])
+        self.assertEqual(backend.get('big', group='chunks'), None)
+        self.assertEqual(backend.get_many(['big', 'small'], group='chunks'), {'small': 1})
+
+        backend.invalidate_group('chunks')
+        self.assertEqual(backend.get('big2', group='chunks'), None)
+
+
+class MetricsTest(ClearMemcachedTest):
+
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        metrics.add_sink(metrics.memory)
+
+    def tearDown(self):
+        metrics.remove_sink(metrics.memory)
+        metrics.memory.clear()
+
+    def test_stats(self):
+        @cached(60, serializer='pickle')
+        def my_func(a):
+            return a
+
+        self.assertEqual(my_func.stats(), {})
+        my_func(1)
+        my_func(1)
+        my_func.get_many([((1,), {}), ((2,), {})])
+        stats = my_func.stats()
+        self.assertEqual(stats['hit']['count'], 2)
+        self.assertEqual(stats['miss']['count'], 2)
+        self.assertEqual(stats['compute_time']['count'], 2)
+        self.assertEqual(stats['get_time']['count'], 3)
+        self.assertEqual(stats['set_time']['count'], 2)
+        self.assertEqual(stats['size']['max'], len(serializers.Codec().dumps(1)))
+
+    def test_no_timeout(self):
+        @cached(None, backend='locmem')
+        def forever_func(a):
+            return a
+
+        caches['locmem'].clear()
+        self.assertEqual(forever_func(1), 1)
+        self.assertEqual(forever_func(1), 1)
+        self.assertEqual(metrics.memory.keyspace(forever_func._full_name), (1, len(pickle.dumps(1, -1))))
+
+    def test_report(self):
+        @cached(60)
+        def reported_func(a):
+            time.sleep(0.01)
+            return 'x' * 100
+
+        reported_func(1)
+        reported_func(1)
+        reported_func(2)
+        reported_func.invalidate(2)
+
+        rows = dict((row['name'], row) for row in function_report())
+        row = rows[reported_func._full_name]
+        self.assertEqual((row['calls'], row['hit_rate'], row['keys']), (3, 1 / 3.0, 1))
+        self.assertGreater(row['bytes'], 100)
+        self.assertGreater(row['saved'], 0.005)
+
+        out = StringIO()
+        call_command('cache_utils_report', sort='memory', stdout=out)
+        self.assertIn(reported_func._full_name, out.getvalue())
+
+    def test_cache_sink(self):
+        sink = metrics.CacheSink(flush_interval=3600)
+        metrics.add_sink(sink)
+        try:
+            @cached(60)
+            def shared_func(a):
+                time.sleep(0.01)
+                return 'x' * 100
+
+            shared_func(1)
+            shared_func(1)
+            shared_func(2)
+        finally:
+            metrics.remove_sink(sink)
+        sink.flush()
+
+        # as read by another process
+        other = metrics.CacheSink()
+        self.assertIn(shared_func._full_name, other.names())
+        stats = other.stats(shared_func._full_name)
+        self.assertEqual((stats['hit']['count'], stats['miss']['count']), (1, 2))
+        self.assertGreater(stats['compute_time']['total'], 0.02)
+        row = dict((row['name'], row) for row in function_report(other))[shared_func._full_name]
+        self.assertEqual((row['calls'], row['keys']), (3, 2))
+        self.assertGreater(row['bytes'], 200)
+
+        other.clear()
+        self.assertEqual(other.names(), [])
+
+    def test_sinks(self):
+        recorded, signalled = [], []
+
+        def receiver(sender, name, metric, value, **kwargs):
+            signalled.append((name, metric))
+
+        callback_sink, signal_sink = metrics.CallbackSink(lambda name, value: recorded.append(name)), metrics.SignalSink()
+        metrics.add_sink(callback_sink)
+        metrics.add_sink(signal_sink)
+        metrics.metric_recorded.connect(receiver)
+        try:
+            cache_utils.cache.set('metrics-key', 1)
+            cache_utils.cache.get('metrics-key')
+        finally:
+            metrics.remove_sink(callback_sink)
+            metrics.remove_sink(signal_sink)
+            metrics.metric_recorded.disconnect(receiver)
+
+        self.assertEqual(recorded, ['cache_utils.cache_utils.cache.set_time', 'cache_utils.cache_utils.cache.get_time',
+                                    'cache_utils.cache_utils.cache.hit'])
+        self.assertEqual(signalled, [('cache_utils.cache', 'set_time'), ('cache_utils.cache', 'get_time'),
+                                     ('cache_utils.cache', 'hit')])
+        self.assertEqual(metrics.memory.stats('cache_utils.cache')['hit']['count'], 1)
+
+        metrics.remove_sink(metrics.memory)
+        self.assertFalse(metrics.enabled)
+
+
+class WarmupTest(TestCase):
+
+    def setUp(self):
+        caches['locmem'].clear()
+        del warmed_calls[:]
+
+    def test_warm(self):
+        seen = []
+        counters = warm(warmed_square, warm_arguments(), batch_size=2, workers=2, progress=seen.append)
+        self.assertEqual(counters, {'seen': 3, 'skipped': 0, 'computed': 3})
+        self.assertEqual([p['seen'] for p in seen], [2, 3])
+        self.assertEqual([warmed_square(1), warmed_square(2), warmed_square(3, 2)], [1, 4, 18])
+        self.assertEqual(sorted(warmed_calls), [1, 2, 3])
+
+        # existing values are refreshed unless only missing ones are asked for
+        warmed_square.invalidate(2)
+        counters = warm(warmed_square, [1, 2, 4], only_missing=True)
+        self.assertEqual(counters, {'seen': 3, 'skipped': 1, 'computed': 2})
+        warm(warmed_square, [1])
+        self.assertEqual(sorted(warmed_calls), [1, 1, 2, 2, 3, 4])
+
+    def test_rate_limit(self):
+        started = time.time()
+        warm(warmed_square, range(6), batch_size=2, writes_per_second=100)
+        self.assertGreaterEqual(time.time() - started, 0.05)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('cache_utils_warm', 'cache_utils.tests.warmed_square', 'cache_utils.tests.warm_arguments',
+                     only_missing=True, stdout=out)
+        self.assertIn("3 computed, 0 skipped", out.getvalue())
+        self.assertEqual(warmed_square.missing([((1,), {}), ((5,), {})]), [((5,), {})])
+
+
+class StampedeTest(TestCase):
+
+    def setUp(self):
+        caches['locmem'].clear()
+        self.call_count = 0
+        self.release = threading.Event()
+
+    def run_threads(self, func, count=5):
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(func(1))) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.1)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_single_flight(self):
+        @cached(60, backend='locmem', single_flight=True)
+        def my_func(a):
+            self.release.wait(5)
+            self.call_count += 1
+            return self.call_count
+
+        self.assertEqual(self.run_threads(my_func), [1] * 5)
+        self.assertEqual(self.call_count, 1)
+
+    def test_lease_wait(self):
+        @cached(60, backend='locmem', lock=True, lock_timeout=5)
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+
+        key = my_func.get_cache_key(1)
+        # another process holds the lease and stores the value
+        caches['locmem'].add(locks.lock_key(key), 'other', 5)
+        threading.Timer(0.1, lambda: caches['locmem'].set(key, 'computed elsewhere', 60)).start()
+        self.assertEqual(my_func(1), 'computed elsewhere')
+        self.assertEqual(self.call_count, 0)
+
+    def test_lease_released(self):
+        @cached(60, backend='locmem', lock=True, lock_timeout=5)
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+
+        key = my_func.get_cache_key(1)
+        # the lease holder gave up without storing a value
+        caches['locmem'].add(locks.lock_key(key), 'other', 5)
+        threading.Timer(0.1, lambda: caches['locmem'].delete(locks.lock_key(key))).start()
+        self.assertEqual(my_func(1), 1)
+        self.assertIsNone(caches['locmem'].get(locks.lock_key(key)))
+
+    def test_group_backend_lease(self):
+        lease = locks.Lease(cache, 'lease-key', 5)
+        self.assertTrue(lease.acquire())
+        # stored raw, so it's not served stale or kept for MINT_DELAY more
+        self.assertEqual(cache._cache.get(cache._make_key(None, lease.key)), lease.token)
+        with mock.patch('cache_utils.group_backend.time.time', return_value=time.time() + 6):
+            self.assertEqual(cache.get(lease.key), lease.token)
+        self.assertFalse(locks.Lease(cache, 'lease-key', 5).acquire())
+        lease.release()
+        self.assertIsNone(cache.get(lease.key))
+
+
+class StaleWhileRevalidateTest(TestCase):
+
+    def setUp(self):
+        caches['locmem'].clear()
+        self.call_count = 0
+
+    def wait_for_calls(self, count):
+        deadline = time.time() + 5
+        while self.call_count < count and time.time() < deadline:
+            time.sleep(0.01)
+
+    def test_sync_refresh(self):
+        @cached(60, backend='locmem', stale_ttl=60)
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+
+        self.assertEqual(my_func(1), 1)
+        self.assertEqual(my_func(1), 1)
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(my_func(1), 2)
+            self.assertEqual(my_func(1), 2)
+        with mock.patch('time.time', return_value=time.time() + 121):
+            # past stale_ttl the value is gone
+            self.assertEqual(my_func(1), 3)
+
+    def test_background_refresh(self):
+        release = threading.Event()
+        release.set()
+
+        @cached(60, backend='locmem', stale_ttl=60, refresh='background')
+        def my_func(a):
+            release.wait(5)
+            self.call_count += 1
+            return self.call_count
+
+        self.assertEqual(my_func(1), 1)
+        release.clear()
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(my_func(1), 1)
+            self.assertEqual(my_func(1), 1)
+            release.set()
+            self.wait_for_calls(2)
+            time.sleep(0.05)
+            self.assertEqual(my_func(1), 2)
+        self.assertEqual(self.call_count, 2)
+
+    def test_get_many(self):
+        @cached(60, backend='locmem', stale_ttl=60)
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+
+        self.assertEqual(my_func.map([1, 2]), [1, 2])
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(my_func.map([1, 2]), [3, 4])
+            self.assertEqual(my_func.map([1, 2]), [3, 4])
+
+    def test_bad_refresh(self):
+        self.assertRaises(ValueError, cached, 60, refresh='never')
+
+
+class AdaptiveTest(TestCase):
+
+    def setUp(self):
+        caches['locmem'].clear()
+        self.call_count = 0
+
+    def test_timeout(self):
+        tracker = adaptive.AdaptivePolicy(10, 1000, warmup=1, weight=1).tracker(60)
+        self.assertEqual(tracker.timeout(), 60)
+        tracker.observe('compute_time', 0.1)
+        tracker.observe('get_time', 0.001)
+        tracker.hit()
+        # 100 times cheaper to fetch and always hit
+        self.assertEqual(tracker.timeout(), 900)
+        tracker.miss()
+        self.assertEqual(tracker.timeout(), 300)
+        tracker.observe('compute_time', 0.0001)
+        self.assertEqual(tracker.timeout(), 10)
+        self.assertRaises(ValueError, adaptive.AdaptivePolicy, 100, 10)
+
+    def test_admission(self):
+        policy = adaptive.AdaptivePolicy(10, 100, admit_ratio=1000, warmup=2, probe_every=5)
+
+        @cached(60, backend='locmem', adaptive=policy)
+        def cheap_func(a):
+            self.call_count += 1
+            return a
+
+        cheap_func(1)
+        cheap_func(2)
+        self.assertEqual(self.call_count, 2)
+        for i in range(4):
+            cheap_func(1)
+        self.assertEqual(self.call_count, 6)
+        # a probe tries the cache
+        cheap_func(1)
+        self.assertEqual(self.call_count, 6)
+        # results computed after warmup are not stored
+        self.assertIsNone(caches['locmem'].get(cheap_func.get_cache_key(2)))
+
+        info = cheap_func.cache_info()['adaptive']
+        self.assertFalse(info['admitted'])
+        self.assertEqual((info['computed'], info['bypassed'], info['rejected']), (6, 5, 1))
+
+    def test_stretched_timeout(self):
+        @cached(60, backend='locmem', adaptive=adaptive.AdaptivePolicy(10, 100, warmup=1))
+        def expensive_func(a):
+            time.sleep(0.01)
+            return 'x' * 100
+
+        expensive_func(1)
+        expensive_func(2)
+        expensive_func(2)
+        info = expensive_func.cache_info()['adaptive']
+        self.assertTrue(info['admitted'])
+        self.assertEqual(info['timeout'], 100)
+        self.assertEqual((info['hits'], info['misses']), (1, 2))
+        self.assertGreater(info['size'], 100)
+        self.assertGreater(info['compute_time'], 0.005)
+
+
+class ModelTableTest(TransactionTestCase):
+    """ Tests which need database tables for test models """
+
+    @classmethod
+    def setUpClass(cls):
+        super(ModelTableTest, cls).setUpClass()
+        with connection.schema_editor() as editor:
+            editor.create_model(Product)
+
+    @classmethod
+    def tearDownClass(cls):
+        with connection.schema_editor() as editor:
+            editor.delete_model(Product)
+        super(ModelTableTest, cls).tearDownClass()
+
+    def setUp(self):
+        cache._cache.flush_all()
+        self.call_count = 0
+
+        @cached(60, model_list=[Product])
+        def my_func(a):
+            self.call_count += 1
+            return self.call_count
+        self.my_func = my_func
+
+    def test_defer_invalidation_on_commit(self):
+        self.assertEqual(self.my_func(1), 1)
+        with transaction.atomic():
+            with defer_invalidation(on_commit=True):
+                models.signals.post_save.send(sender=Product, instance=Product(name='x'))
+            self.assertEqual(self.my_func(1), 1)
+        self.assertEqual(self.my_func(1), 2)
+
+    def test_bulk_update(self):
+        self.assertEqual(self.my_func(1), 1)
+        product = Product.objects.create(name='x')
+        self.assertEqual(self.my_func(1), 2)
+        product.name = 'y'
+        bulk_update(Product, [product], ['name'])
+        self.assertEqual(self.my_func(1), 3)
+
+    def test_cached_instances(self):
+        @cached_instances(Product, 60)
+        def products(prefix):
+            return Product.objects.filter(name__startswith=prefix).order_by('id')
+
+        a1, a2, b1 = [Product.objects.create(name=name) for name in ('a1', 'a2', 'b1')]
+        with self.assertNumQueries(2):
+            self.assertEqual(products('a'), [a1, a2])
+        with self.assertNumQueries(0):
+            self.assertEqual([p.name for p in products('a')], ['a1', 'a2'])
+            self.assertEqual(products.pks('a'), [a1.pk, a2.pk])
+
+        # the list is rebuilt, only the saved instance is fetched again
+        a2.name = 'a2 renamed'
+        a2.save()
+        with self.assertNumQueries(2):
+            self.assertEqual([p.name for p in products('a')], ['a1', 'a2 renamed'])
+        with self.assertNumQueries(1):
+            self.assertEqual(get_instances(Product, [b1.pk, a1.pk, 0]), [b1, a1])
+        with self.assertNumQueries(0):
+            self.assertEqual(get_instances(Product, [b1.pk, a1.pk]), [b1, a1])
+        # instances expire with the backend's default timeout
+        locmem = caches['locmem']
+        locmem.clear()
+        get_instances(Product, [b1.pk], 'locmem')
+        self.assertIsNotNone(locmem._expire_info[locmem.make_key('_instance::cache_utils.product:%s' % b1.pk)])
+
+        b1.name = 'a3'
+        bulk_update(Product, [b1], ['name'])
+        pk = a1.pk
+        with defer_invalidation():
+            a1.delete()
+            # still cached until the block exits
+            self.assertEqual([p.name for p in get_instances(Product, [pk])], ['a1'])
+        self.assertEqual(get_instances(Product, [pk]), [])
+        self.assertEqual([p.name for p in products('a')], ['a2 renamed', 'a3'])
+        products.invalidate('a')
+        self.assertEqual(cache.get(products.get_cache_key('a')), None)
+
+
 class UtilsTest(TestCase):
 
     def example_function(self, request, number):
@@ -270,6 +1471,54 @@ class UtilsTest(TestCase):
         self.assertEqual(stringified_args, expected_stringified_args)
         self.assertEqual(stringified_kwargs, expected_stringified_kwargs)
 
+    def test_key_builder(self):
+        """ Precompiled key builders make the same keys as _cache_key """
+        request = HttpRequest()
+        request.path = '/numerator/'
+        object_attrs = {HttpRequest: ['path']}
+        arg_sets = [
+            ((), {}),
+            ((1, 'a b\tc'), {}),
+            ((), {'x': [1, 2], 'y': None}),
+            ((u'Вася', 2.5), {'z': u'й' * 300}),
+            ((request, 1), {'page': 2}),
+        ]
+        for func_type in ('function', 'method'):
+            for attrs in (None, object_attrs):
+                build = make_key_builder(func_type, object_attrs=attrs)
+                build_hashed = make_key_builder(func_type, hashed=True, object_attrs=attrs)
+                build_named = make_key_builder(func_type, key='foo', object_attrs=attrs)
+                for args, kwargs in arg_sets:
+                    key = _cache_key('mod.func:1', func_type, args, kwargs, attrs)
+                    self.assertEqual(build('mod.func:1', args, kwargs), sanitize_memcached_key(key))
+                    self.assertEqual(build_hashed('mod.func:1', args, kwargs), sha256(key.encode()).hexdigest())
+                    named_key = _cache_key('foo', func_type, args, kwargs, attrs)
+                    self.assertEqual(build_named('mod.func:1', args, kwargs), sanitize_memcached_key(named_key))
+
+    def test_compact_keys(self):
+        build = make_key_builder('method', key_format='compact')
+        key = build('mod.Foo.bar:1', (None, 1, 'a'), {'page': 2})
+        self.assertEqual(len(key), 34)
+        self.assertTrue(key.startswith(build('mod.Foo.bar:1', (None, 2), {})[:11]))
+        self.assertNotEqual(key, build('mod.Foo.bar:1', (None, 1, 'a'), {'page': 3}))
+        self.assertNotEqual(key[:11], build('mod.Foo.baz:1', (None, 1, 'a'), {'page': 2})[:11])
+        self.assertEqual(sanitize_memcached_key(key), key)
+        self.assertRaises(ValueError, make_key_builder, 'function', key_format='short')
+
+    def test_compact_key_map(self):
+        @cached(60, key_format='compact', backend='locmem')
+        def foo(a):
+            return a
+
+        with override_settings(CACHE_UTILS_COMPACT_KEY_MAP=True):
+            @cached(60, key_format='compact', model_list=[Product], backend='locmem')
+            def bar(a):
+                return a
+
+        self.assertEqual(readable_key(foo.get_cache_key(1)), None)
+        self.assertEqual(bar(1), 1)
+        self.assertEqual(readable_key(bar.get_cache_key(1)), '[cached]%s((1,))' % bar._full_name)
+
     def test_function_with_http_request(self):
         def my_function(request, a, b):
             return a + b
@@ -1,13 +1,21 @@
+import re
+import threading
+from base64 import urlsafe_b64encode
 from collections import OrderedDict
-from hashlib import sha256
+from hashlib import blake2b, sha256
 from typing import Tuple
 
-from django.utils.encoding import smart_str
+from django.utils.encoding import force_bytes, smart_str
 import six
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 
 CONTROL_CHARACTERS = set([chr(i) for i in range(0, 33)])
 CONTROL_CHARACTERS.add(chr(127))
+_CONTROL_CHARACTERS_RE = re.compile('[\x00-\x20\x7f]')
 
 
 def sanitize_memcached_key(key, max_length=250):
@@ -15,17 +23,58 @@ def sanitize_memcached_key(key, max_length=250):
         not hit the memcached key length limit by replacing
         the key tail with sha256 hash if key is too long.
     """
-    key = ''.join([c for c in key if c not in CONTROL_CHARACTERS])
-    if len(key) > max_length:
-        try:
-            from django.utils.encoding import force_bytes
-            return sha256(force_bytes(key)).hexdigest()
-        except ImportError:  # Python 2
-            hash = sha256(key).hexdigest()
-        key = key[:max_length - 65] + '-' + hash
+    # spaces come from stringified args and are by far the most common
+    key = key.replace(' ', '')
+    if _CONTROL_CHARACTERS_RE.search(key) is not None:
+        key = _CONTROL_CHARACTERS_RE.sub('', key)
+    # the limit is in bytes
+    if len(key) > max_length or (not key.isascii() and len(key.encode()) > max_length):
+        data = force_bytes(key)
+        hash = sha256(data).hexdigest()
+        if max_length <= len(hash) + 1:
+            return hash[:max_length]
+        # keep the readable head, e.g. the function name
+        key = data[:max_length - len(hash) - 1].decode('utf-8', 'ignore') + '-' + hash
     return key
 
 
+# Readable keys of compact keys built in this process, if
+# CACHE_UTILS_COMPACT_KEY_MAP is set (for development only).
+_compact_keys = OrderedDict()
+_compact_keys_lock = threading.Lock()
+COMPACT_KEY_MAP_SIZE = 10000
+
+
+if xxhash is not None and hasattr(xxhash, 'xxh3_128'):
+    _DIGEST_MARK, _hash128 = 'x', xxhash.xxh3_128
+else:
+    _DIGEST_MARK, _hash128 = 'b', lambda data: blake2b(data, digest_size=16)
+
+
+def _digest(data):
+    """ Returns a 128 bit digest of data, base64 encoded in 22 characters.
+        The algorithm is marked by the first character, so processes with
+        and without xxhash installed never mix up keys.
+    """
+    return _DIGEST_MARK + urlsafe_b64encode(_hash128(data).digest()).decode()[:22]
+
+
+def _remember_compact_key(compact_key, key):
+    with _compact_keys_lock:
+        _compact_keys[compact_key] = key
+        if len(_compact_keys) > COMPACT_KEY_MAP_SIZE:
+            _compact_keys.popitem(last=False)
+
+
+def readable_key(compact_key):
+    """ Returns the readable key a compact key was built from, if it was
+        built in this process with CACHE_UTILS_COMPACT_KEY_MAP set.
+        Keys with model or tag tokens appended are looked up without them.
+    """
+    with _compact_keys_lock:
+        return _compact_keys.get(':'.join(compact_key.split(':')[:3]))
+
+
 def _args_to_unicode(args, kwargs):
     key = ""
     if args:
@@ -84,7 +133,7 @@ def stringify_args(args, kwargs, object_attrs: dict) -> Tuple[tuple, dict]:
 
     def stringify(obj):
         if isinstance(obj, (list, tuple)):
-            return obj.__class__.__name__ + "(" + ", ".join(stringify(e) for e in obj) + ")"
+            return obj.__class__.__name__ + "(" + ", ".join(str(stringify(e)) for e in obj) + ")"
         elif isinstance(obj, dict):
             sorted_items = sorted(obj.items())  # sort to ensure consistent ordering for < py 3.6
             return "{" + ", ".join("{!r}: {}".format(k, stringify(v)) for k, v in sorted_items) + "}"
@@ -130,3 +179,59 @@ def _cache_key(func_name, func_type, args, kwargs, object_attrs=None) -> str:
         args_string = _args_to_unicode(obj_args[1:], obj_kwargs)
 
     return '[cached]%s(%s)' % (func_name, args_string,)
+
+
+def make_key_builder(func_type, key=None, hashed=False, object_attrs=None, key_format=None):
+    """
+    Build a specialized cache key function for a decorated callable. All the
+    decisions `_cache_key` and the `cached` decorator make on every call are
+    made once here, and keys are identical to the ones they produce.
+
+    With `key_format='compact'` keys are a short per-function prefix (a
+    digest of the function's full name or `key`) and a 128 bit digest of
+    the readable key, 34 characters in total, e.g. ``c:q2Y0xNq1:bX3...``.
+
+    Args:
+        func_type (str): The type of the function ('function', 'method', or 'classmethod').
+        key (str, optional): Name used instead of the function's full name.
+        hashed (bool): Whether to use the sha256 hex digest of the key.
+        object_attrs (dict, optional): A dictionary containing the class of the objects as keys and
+            a list of attribute names as values. Default is None.
+        key_format (str, optional): 'compact' for short digest keys, readable keys by default.
+
+    Returns:
+        Callable[[str, tuple, dict], str]: A function of (func_name, args, kwargs) returning the key.
+    """
+    if key_format not in (None, 'readable', 'compact'):
+        raise ValueError("key_format must be 'readable' or 'compact'")
+    key = key or None
+    skip_first = func_type != 'function'
+    sanitize = sanitize_memcached_key
+    compact = key_format == 'compact'
+    if compact:
+        from django.conf import settings
+        remember = getattr(settings, 'CACHE_UTILS_COMPACT_KEY_MAP', False)
+        # methods get their full name, with the class name, on every call
+        prefixes = {}
+
+    def build(func_name, args, kwargs):
+        if object_attrs is not None:
+            args, kwargs = stringify_args(args, kwargs, object_attrs)
+        if skip_first:
+            args = args[1:]
+        if key is not None:
+            func_name = key
+        cache_key = '[cached]%s(%s%s)' % (func_name, str(args) if args else '', str(kwargs) if kwargs else '')
+        if compact:
+            prefix = prefixes.get(func_name)
+            if prefix is None:
+                prefix = prefixes[func_name] = 'c:%s:' % _digest(func_name.encode())[1:9]
+            compact_key = prefix + _digest(cache_key.encode())
+            if remember:
+                _remember_compact_key(compact_key, cache_key)
+            return compact_key
+        if hashed and key is None:
+            return sha256(cache_key.encode()).hexdigest()
+        return sanitize(cache_key)
+
+    return build
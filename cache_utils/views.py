@@ -0,0 +1,145 @@
+"""
+Caching of rendered responses of views. `cached_view` keys responses the
+way `cached` keys results, with the request given by `request_attrs`, and
+stores the headers (with an ETag and Last-Modified) apart from the body,
+so conditional requests are answered with 304 without fetching the body.
+"""
+
+import time
+from hashlib import blake2b
+
+from django.http import HttpRequest, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.functional import wraps
+from django.utils.http import http_date, parse_http_date_safe
+
+from django.core.handlers.wsgi import WSGIRequest
+try:
+    from django.core.handlers.asgi import ASGIRequest
+except ImportError:  # Django < 3.0
+    ASGIRequest = None
+
+from cache_utils.decorators import _BackendProxy, registry
+from cache_utils.utils import _func_info, make_key_builder, sanitize_memcached_key
+
+
+# the body is stored after its digest, so a body left from another
+# response is never served
+_DIGEST_LENGTH = 32
+
+
+def _digest(content):
+    return blake2b(content, digest_size=16).hexdigest()
+
+
+def _cacheable(response):
+    # responses which vary on request headers are keyed by request_attrs
+    # only, so any of them could be served to a request it doesn't fit
+    cache_control = response.get('Cache-Control', '')
+    return (response.status_code == 200 and not response.streaming and not response.cookies
+            and not response.has_header('Vary')
+            and 'private' not in cache_control and 'no-store' not in cache_control)
+
+
+def cached_view(timeout, group=None, backend='default', key=None, model_list=[], request_attrs=('path', 'GET')):
+    """ Caches successful responses of a view for `timeout` seconds::
+
+            @cached_view(60*15, group='catalog', model_list=[Product])
+            def product_list(request, category):
+                ...
+
+        Responses are shared by requests with the same view arguments and
+        `request_attrs`; add e.g. 'user' to them for per-user pages. Only
+        GET and HEAD requests are cached, and only responses with status
+        200 which don't set cookies, aren't private and have no `Vary`
+        header.
+
+        Views which read `request.user` or the session must have them in
+        `request_attrs`: SessionMiddleware adds `Vary: Cookie` after the
+        response is stored, so it can't keep the response from being
+        shared.
+
+        Headers are stored with an ETag (a digest of the body, unless the
+        view sets one) and Last-Modified. Requests with `If-None-Match` or
+        `If-Modified-Since` fetch the headers only and get 304 if they
+        match; other requests fetch headers and body with one `get_many`.
+
+        Responses are invalidated with the group (group backend only) and
+        by saves of `model_list` models, like `cached` results; the
+        wrapper's `invalidate(request, *args, **kwargs)` drops one.
+    """
+    backend_kwargs = {'group': group} if group else {}
+    cache_backend = _BackendProxy(backend)
+    for model in model_list:
+        registry.register_model(model)
+    request_classes = [cls for cls in (HttpRequest, WSGIRequest, ASGIRequest) if cls is not None]
+    object_attrs = dict((cls, list(request_attrs)) for cls in request_classes)
+
+    def _cached_view(view):
+        name = _func_info(view, ())[0]
+        build = make_key_builder('function', key, object_attrs=object_attrs)
+
+        def _keys(request, args, kwargs):
+            head_key = registry.make_key(build(name, (request,) + args, kwargs), model_list)
+            return head_key, sanitize_memcached_key(head_key + ':body')
+
+        def _response(head, body=b''):
+            response = HttpResponse(body[_DIGEST_LENGTH:], status=head['status'])
+            for header, value in head['headers']:
+                response[header] = value
+            return response
+
+        def _conditional(request, head):
+            """ Returns 304 (or 412) if the request's preconditions say so """
+            response = _response(head)
+            conditional = get_conditional_response(request, head['etag'], head['last_modified'], response)
+            return None if conditional is response else conditional
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            head_key, body_key = _keys(request, args, kwargs)
+
+            if 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META:
+                head = cache_backend.get(head_key, **backend_kwargs)
+                if head is not None:
+                    conditional = _conditional(request, head)
+                    if conditional is not None:
+                        return conditional
+                    body = cache_backend.get(body_key, **backend_kwargs)
+                    if body is not None and body[:_DIGEST_LENGTH] == head['digest'].encode():
+                        return _response(head, body)
+            else:
+                values = cache_backend.get_many([head_key, body_key], **backend_kwargs)
+                head, body = values.get(head_key), values.get(body_key)
+                if head is not None and body is not None and body[:_DIGEST_LENGTH] == head['digest'].encode():
+                    return _response(head, body)
+
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render') and callable(response.render):
+                response.render()
+            if not _cacheable(response):
+                return response
+            digest = _digest(response.content)
+            if not response.has_header('ETag'):
+                response['ETag'] = '"%s"' % digest
+            if not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(time.time())
+            head = {
+                'status': response.status_code,
+                'digest': digest,
+                'etag': response['ETag'],
+                'last_modified': parse_http_date_safe(response['Last-Modified']),
+                'headers': list(response.items()),
+            }
+            cache_backend.set_many({head_key: head, body_key: digest.encode() + response.content}, timeout,
+                                   **backend_kwargs)
+            return get_conditional_response(request, head['etag'], head['last_modified'], response)
+
+        def invalidate(request, *args, **kwargs):
+            cache_backend.delete_many(list(_keys(request, args, kwargs)), **backend_kwargs)
+
+        wrapper.invalidate = invalidate
+        return wrapper
+    return _cached_view
@@ -0,0 +1,99 @@
+"""
+Pre-computation of cached function results, e.g. after a deploy or a group
+invalidation, so the hottest keys don't all miss at once.
+"""
+
+import itertools
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.db import connections
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger("cache_utils")
+
+
+def _as_call(item):
+    """ Items are tuples of positional arguments or single arguments """
+    return (item if isinstance(item, tuple) else (item,)), {}
+
+
+def _compute(func, calls):
+    try:
+        return [func(*args, **kwargs) for args, kwargs in calls]
+    finally:
+        # database connections are per thread, don't leak them
+        connections.close_all()
+
+
+def _compute_by_path(path, calls):
+    """ Runs in worker processes, where the function is imported again """
+    return _compute(import_string(path).__wrapped__, calls)
+
+
+def _split(calls, parts):
+    size = max(1, -(-len(calls) // parts))
+    return [calls[i:i + size] for i in range(0, len(calls), size)]
+
+
+def warm(func, arguments, only_missing=False, batch_size=100, workers=4, processes=False,
+         writes_per_second=None, progress=None):
+    """ Computes and stores results of the `cached` function `func` for
+        every item of `arguments`, a tuple of positional arguments or a
+        single argument. Existing values are refreshed, as `force_recalc`
+        does, unless `only_missing` is set: then the existence of every
+        batch is checked with one `get_many` first.
+
+        `arguments` is consumed lazily, `batch_size` items at a time;
+        querysets are read with `.iterator()`. Each batch is computed in a
+        pool of `workers` threads, or processes if `processes` is set (for
+        module level functions only), and written with one `set_many`.
+        `writes_per_second` limits the rate of keys written to the backend.
+        `progress` is called with the returned counters of items seen,
+        skipped and computed after each batch.
+    """
+    if hasattr(arguments, 'iterator'):
+        arguments = arguments.iterator()
+    arguments = iter(arguments)
+    counters = {'seen': 0, 'skipped': 0, 'computed': 0}
+
+    if processes:
+        # forked workers must not share the parent's database connections
+        connections.close_all()
+        executor = ProcessPoolExecutor(max_workers=workers)
+        path = "%s.%s" % (func.__module__, func.__qualname__)
+
+        def compute(calls):
+            return executor.submit(_compute_by_path, path, calls)
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+        def compute(calls):
+            return executor.submit(_compute, func.__wrapped__, calls)
+
+    started = time.time()
+    with executor:
+        while True:
+            calls = [_as_call(item) for item in itertools.islice(arguments, batch_size)]
+            if not calls:
+                break
+            counters['seen'] += len(calls)
+            if only_missing:
+                missing = func.missing(calls)
+                counters['skipped'] += len(calls) - len(missing)
+                calls = missing
+            if calls:
+                futures = [compute(part) for part in _split(calls, workers)]
+                results = [result for future in futures for result in future.result()]
+                if writes_per_second:
+                    delay = started + float(counters['computed'] + len(calls)) / writes_per_second - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                func.store_many(calls, results)
+                counters['computed'] += len(calls)
+            logger.debug("Cache WARM: %s %s", func._full_name, counters)
+            if progress is not None:
+                progress(dict(counters))
+    return counters
@@ -25,6 +25,9 @@ class TestCommand(Command):
                     'BACKEND': 'cache_utils.group_backend.CacheClass',
                     'LOCATION': '127.0.0.1:11211',
                 },
+                'locmem': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                },
             },
             DATABASES={
                 'default': {
@@ -42,7 +45,7 @@ setup(
     version=version,
     author='Mikhail Korobov',
     author_email='kmike84@gmail.com',
-    packages=['cache_utils'],
+    packages=['cache_utils', 'cache_utils.management', 'cache_utils.management.commands'],
     url='https://github.com/infoscout/django-cache-utils',
     license='MIT license',
     description=(